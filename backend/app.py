@@ -1,37 +1,317 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, g, abort
 from flask_cors import CORS
+from werkzeug.http import parse_content_range_header
+from werkzeug.security import safe_join
 import os
+import re
+import json
+import base64
+import hashlib
+import sqlite3
 from datetime import datetime
 
+from blob_store import CHUNK_SIZE, BlobStore
+from patch_jobs import DONE, JOB_FIELDS, PatchQueue, jar_spec
+from upload_sessions import UploadSessions
+
 UPLOAD_FOLDER = 'uploads'
+DATABASE = os.environ.get('A15_DATABASE', 'history.db')
+HISTORY_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+# Behind nginx, set A15_ACCEL_REDIRECT to the internal location that maps to
+# the backend's working directory (e.g. /protected/); behind Apache/lighttpd set
+# A15_X_SENDFILE=1. Otherwise the WSGI server streams the file itself, with
+# sendfile() where it supports wsgi.file_wrapper (gunicorn does).
+ACCEL_REDIRECT = os.environ.get('A15_ACCEL_REDIRECT')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CONTENT_ADDRESSED = re.compile(r'[0-9a-f]{64}(\.[\w.-]+)?$')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
-CORS(app)
+app.config['USE_X_SENDFILE'] = os.environ.get('A15_X_SENDFILE') == '1'
+CORS(app, expose_headers=['ETag', 'Link', 'X-Next-Cursor', 'Accept-Ranges', 'Content-Range', 'Upload-Offset'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    desc TEXT,
+    time TEXT NOT NULL,
+    sha256 TEXT,
+    original TEXT
+);
+CREATE INDEX IF NOT EXISTS history_time ON history (time, id);
+"""
+
+def get_db():
+    # One connection per request; WAL lets several gunicorn workers read while one writes.
+    if 'db' not in g:
+        g.db = sqlite3.connect(DATABASE, timeout=30)
+        g.db.row_factory = sqlite3.Row
+        g.db.execute('PRAGMA journal_mode=WAL')
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+HISTORY_FIELDS = ('filename', 'name', 'desc', 'time', 'sha256', 'original')
+
+def init_db():
+    with sqlite3.connect(DATABASE) as db:
+        db.executescript(SCHEMA)
+        # Databases created before uploads were content-addressed lack these.
+        columns = {row[1] for row in db.execute('PRAGMA table_info(history)')}
+        for column in ('sha256', 'original'):
+            if column not in columns:
+                db.execute(f'ALTER TABLE history ADD COLUMN {column} TEXT')
+
+init_db()
+blob_store = BlobStore(UPLOAD_FOLDER)
+patch_queue = PatchQueue(DATABASE, blob_store)
+upload_sessions = UploadSessions(DATABASE, blob_store)
+UPLOAD_CHUNK_SIZE = 8 * CHUNK_SIZE
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row['time'], row['id']]).encode()).decode()
 
-history = []
+def decode_cursor(cursor):
+    try:
+        time, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(time), int(row_id)
+    except (ValueError, TypeError):
+        return None
 
 @app.route('/api/upload', methods=['POST'])
 def upload():
+    """
+    Store the jar under its SHA-256. A sent file is always hashed while it
+    is written, must match the hash the client claims (X-Content-SHA256
+    header or sha256 field) if it sent one, and identical content keeps the
+    existing blob. Only a request without a file part may refer to a blob by
+    its hash alone, to skip re-sending a jar the server already has; anyone
+    who knows a stored jar's SHA-256 can add it to the history this way.
+    """
     file = request.files.get('file')
     name = request.form.get('name')
     desc = request.form.get('desc')
-    if not file or not name:
+    expected = request.headers.get('X-Content-SHA256') or request.form.get('sha256')
+    if not name or not (file or expected):
         return jsonify({'error': 'Eksik bilgi!'}), 400
-    filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
-    entry = {'filename': filename, 'name': name, 'desc': desc, 'time': datetime.now().isoformat()}
-    history.append(entry)
-    return jsonify({'ok': True, 'entry': entry})
+    original = file.filename if file else request.form.get('filename')
+    if file:
+        try:
+            sha256, _, new = blob_store.put_stream(file.stream, expected)
+        except ValueError:
+            return jsonify({'error': 'Dosya doğrulanamadı!'}), 400
+    elif blob_store.exists(expected):
+        sha256, new = expected, False
+    else:
+        return jsonify({'error': 'Dosya bulunamadı, dosyayı gönderin!', 'missing': True}), 404
+    return finish_upload(sha256, new, original, name, desc)
+
+def finish_upload(sha256, new, original, name, desc):
+    spec = None
+    if request.form.get('patch'):
+        spec = jar_spec(request.form.get('jar') or original)
+        if not spec:
+            return jsonify({'error': 'Bilinmeyen jar dosyası!'}), 400
+    entry = {'filename': blob_store.name(sha256), 'name': name, 'desc': desc, 'time': datetime.now().isoformat(),
+             'sha256': sha256, 'original': original}
+    db = get_db()
+    with db:
+        db.execute('INSERT INTO history (filename, name, desc, time, sha256, original) '
+                   'VALUES (:filename, :name, :desc, :time, :sha256, :original)', entry)
+    if spec:
+        # Queue the jar for patching; poll /api/jobs/<id> for the result.
+        job = patch_queue.submit(sha256, spec, request.form.get('api', '35'))
+        return jsonify({'ok': True, 'entry': entry, 'duplicate': not new, 'job': job_json(job)}), 202
+    return jsonify({'ok': True, 'entry': entry, 'duplicate': not new})
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    """
+    Start a resumable upload: {filename, size, sha256}. If the server
+    already has the content, answers duplicate and no session is needed;
+    finish it with /api/upload and the sha256 field.
+    """
+    data = request.get_json(silent=True) or {}
+    size = data.get('size')
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'Eksik bilgi!'}), 400
+    if blob_store.exists(data.get('sha256')):
+        return jsonify({'duplicate': True, 'sha256': data['sha256']})
+    session = upload_sessions.create(data.get('filename'), size, data.get('sha256'))
+    return jsonify(session_json(session)), 201
+
+def session_json(session):
+    return {'id': session['id'], 'offset': session['offset'], 'size': session['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE}
+
+def session_response(session, status=200):
+    response = jsonify(session_json(session))
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(session['offset'])
+    return response
+
+@app.route('/api/uploads/<session_id>', methods=['GET', 'HEAD'])
+def get_upload_session(session_id):
+    session = upload_sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Yükleme bulunamadı!'}), 404
+    return session_response(session)
+
+@app.route('/api/uploads/<session_id>', methods=['PUT'])
+def put_upload_chunk(session_id):
+    """Write the body at the offset given by Content-Range (bytes start-end/total) or ?offset=."""
+    session = upload_sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Yükleme bulunamadı!'}), 404
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    offset = content_range.start if content_range else request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Eksik bilgi!'}), 400
+    try:
+        session['offset'] = upload_sessions.write(session, offset, request.stream)
+    except ValueError as e:
+        response = session_response(upload_sessions.get(session_id), 409)
+        response.headers['X-Error'] = str(e)
+        return response
+    return session_response(session)
+
+@app.route('/api/uploads/<session_id>', methods=['DELETE'])
+def delete_upload_session(session_id):
+    upload_sessions.delete(session_id)
+    return '', 204
+
+@app.route('/api/uploads/<session_id>/finalize', methods=['POST'])
+def finalize_upload_session(session_id):
+    """Check the uploaded file against sha256 and record it like /api/upload does."""
+    session = upload_sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Yükleme bulunamadı!'}), 404
+    name = request.form.get('name')
+    if not name:
+        return jsonify({'error': 'Eksik bilgi!'}), 400
+    try:
+        sha256, new = upload_sessions.finalize(session, request.form.get('sha256'))
+    except ValueError as e:
+        return jsonify({'error': 'Dosya doğrulanamadı!', 'detail': str(e), 'offset': session['offset']}), 409
+    return finish_upload(sha256, new, session['filename'], name, request.form.get('desc'))
+
+def job_json(job):
+    data = {key: job[key] for key in JOB_FIELDS}
+    if job['status'] == DONE:
+        data['result'] = f"/api/jobs/{job['id']}/result"
+    return data
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = patch_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'İş bulunamadı!'}), 404
+    return jsonify(job_json(job))
+
+@app.route('/api/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = patch_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'İş bulunamadı!'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': 'İş henüz tamamlanmadı!', 'status': job['status']}), 409
+    spec = jar_spec(job['jar'])
+    return send_artifact(patch_queue.result_path(job), as_attachment=True, download_name=spec.jar)
 
 @app.route('/api/history')
 def get_history():
-    return jsonify(history[::-1])
+    """
+    Newest uploads first, at most `limit` per page. The cursor of the next
+    page is sent in X-Next-Cursor and a Link header; pass it back as
+    `cursor`. Every response has an ETag, so polling with If-None-Match
+    costs a 304 until something is uploaded.
+    """
+    limit = min(max(request.args.get('limit', HISTORY_LIMIT, type=int), 1), HISTORY_MAX_LIMIT)
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and after is None:
+        return jsonify({'error': 'Geçersiz cursor!'}), 400
+
+    db = get_db()
+    # History is append-only, so the row count and the last id identify its state.
+    count, last_id = db.execute('SELECT count(*), max(id) FROM history').fetchone()
+    etag = hashlib.sha256(f"{count}:{last_id}:{cursor}:{limit}".encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    if after:
+        rows = db.execute('SELECT * FROM history WHERE (time, id) < (?, ?) ORDER BY time DESC, id DESC LIMIT ?',
+                          (*after, limit + 1)).fetchall()
+    else:
+        rows = db.execute('SELECT * FROM history ORDER BY time DESC, id DESC LIMIT ?', (limit + 1,)).fetchall()
+    response = jsonify([{key: row[key] for key in HISTORY_FIELDS} for row in rows[:limit]])
+    if len(rows) > limit:
+        next_cursor = encode_cursor(rows[limit - 1])
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'</api/history?limit={limit}&cursor={next_cursor}>; rel="next"'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+etag_cache = {}
+
+def file_etag(path, stat):
+    # Strong ETag from the content, hashed once per (path, size, mtime).
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in etag_cache:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha256.update(chunk)
+        etag_cache[key] = sha256.hexdigest()
+    return etag_cache[key]
+
+def send_artifact(path, as_attachment=False, download_name=None):
+    """
+    Send a file with a strong ETag, Range and conditional request support.
+    Files named by their SHA-256 never change, so they are sent as
+    immutable with the hash as ETag.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    name = os.path.basename(path)
+    content_addressed = CONTENT_ADDRESSED.match(name)
+    etag = name.split('.')[0] if content_addressed else file_etag(path, stat)
+    cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if content_addressed else 'no-cache'
+
+    if ACCEL_REDIRECT:
+        response = app.response_class(status=200)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response = response.make_conditional(request)
+        if response.status_code == 200:
+            # nginx serves the bytes, ranges included, from the internal location.
+            response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT.rstrip('/') + '/' + os.path.relpath(path)
+            if as_attachment:
+                response.headers['Content-Disposition'] = f'attachment; filename="{download_name or name}"'
+    else:
+        response = send_file(os.path.abspath(path), as_attachment=as_attachment, download_name=download_name,
+                             etag=etag, conditional=True, last_modified=stat.st_mtime)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 @app.route('/uploads/<path:filename>')
 def download(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if path is None:
+        abort(404)
+    return send_artifact(path)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
@@ -0,0 +1,64 @@
+import os
+import re
+import shutil
+import hashlib
+
+CHUNK_SIZE = 1 << 20
+SHA256 = re.compile(r'[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """
+    Files stored under the SHA-256 of their content, as <sha256>.jar in one
+    directory. A blob is only ever written once; storing the same content
+    again keeps the existing file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def name(self, sha256):
+        return f"{sha256}.jar"
+
+    def path(self, sha256):
+        return os.path.join(self.directory, self.name(sha256))
+
+    def exists(self, sha256):
+        return bool(SHA256.match(sha256 or '')) and os.path.exists(self.path(sha256))
+
+    def put_stream(self, stream, expected_sha256=None):
+        """
+        Hash stream while writing it to a temp file in the store, then move it
+        to its blob name. Returns (sha256, size, new). Raises ValueError if
+        expected_sha256 is given and does not match.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.directory, f".upload-{os.getpid()}-{id(stream)}.tmp")
+        try:
+            with open(tmp_path, 'wb') as file:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            if expected_sha256 and digest != expected_sha256:
+                raise ValueError(f"SHA-256 mismatch: expected {expected_sha256}, got {digest}")
+            new = self.put_file(tmp_path, digest)
+            return digest, size, new
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_file(self, path, sha256):
+        """Move a file whose SHA-256 is known into the store. Returns True if it was new."""
+        target = self.path(sha256)
+        if os.path.exists(target):
+            os.remove(path)
+            return False
+        try:
+            os.replace(path, target)
+        except OSError:  # different filesystem
+            shutil.move(path, target)
+        return True
@@ -0,0 +1,229 @@
+import os
+import sys
+import uuid
+import shutil
+import socket
+import sqlite3
+import logging
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from pipeline import JARS  # noqa: E402
+from smali_utils import file_sha256  # noqa: E402
+
+JOBS_DIR = os.environ.get('A15_JOBS_DIR', 'jobs')
+# Concurrent patch jobs per process: under gunicorn every worker process runs
+# up to this many, so the machine-wide limit is workers * A15_PATCH_WORKERS.
+PATCH_WORKERS = int(os.environ.get('A15_PATCH_WORKERS', 1))
+BAKSMALI = os.environ.get('A15_BAKSMALI', os.path.join(ROOT_DIR, 'tools', 'baksmali.jar'))
+SMALI = os.environ.get('A15_SMALI', os.path.join(ROOT_DIR, 'tools', 'smali.jar'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    jar TEXT NOT NULL,
+    api TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created TEXT NOT NULL,
+    finished TEXT,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+CREATE TABLE IF NOT EXISTS artifacts (
+    source TEXT NOT NULL,
+    jar TEXT NOT NULL,
+    api TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    PRIMARY KEY (source, jar, api)
+);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+ACTIVE = f"status IN ('{QUEUED}', '{RUNNING}')"
+# At most one active job per key, enforced by the database so that several
+# worker processes cannot start the same job twice.
+ACTIVE_KEY_INDEX = f"CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key) WHERE {ACTIVE}"
+HOSTNAME = socket.gethostname()
+JOB_FIELDS = ('id', 'jar', 'api', 'status', 'error', 'created', 'finished')
+
+
+def process_alive(owner):
+    """Whether the process that owns a job, "host:pid", still runs. Owners on other hosts are assumed alive."""
+    host, _, pid = (owner or '').rpartition(':')
+    if not host:
+        return False
+    if host != HOSTNAME:
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def jar_spec(name):
+    """Return the pipeline JarSpec for an uploaded file or jar name, e.g. services.jar or services."""
+    base = os.path.basename(name or '')
+    for spec in JARS:
+        if base in (spec.jar, spec.name):
+            return spec
+    return None
+
+
+class PatchQueue:
+    """
+    Runs pipeline.py for uploaded jars on a bounded thread pool, each job
+    in its own workspace under JOBS_DIR. The threads only wait on the
+    pipeline process, so requests never patch in the request thread.
+    Submitting a jar that is already queued or running with the same
+    content and API level returns the existing job, and one that was
+    patched before returns the finished job right away: patched jars go
+    into the blob store and are recorded as artifacts of their source blob.
+
+    Each job is owned by the process whose pool runs it, and the workers
+    limit applies per process. Jobs left queued or running by a process
+    that exited are marked failed, so that new submissions start over.
+    """
+
+    def __init__(self, database, blob_store, workers=PATCH_WORKERS, jobs_dir=JOBS_DIR):
+        self.database = database
+        self.blob_store = blob_store
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='patch-job')
+        self.owner = f"{HOSTNAME}:{os.getpid()}"
+        self.active = set()
+        os.makedirs(jobs_dir, exist_ok=True)
+        db = self.connect()
+        try:
+            with db:
+                db.executescript(SCHEMA)
+                # Databases created before jobs had owners lack the column.
+                if 'owner' not in {row[1] for row in db.execute('PRAGMA table_info(jobs)')}:
+                    db.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            with db:
+                db.execute('BEGIN IMMEDIATE')
+                self.fail_stale_jobs(db)
+                # Older databases may hold duplicate active rows from before the index.
+                db.execute(f"UPDATE jobs SET status = ?, error = ? WHERE {ACTIVE} AND rowid NOT IN "
+                           f"(SELECT MIN(rowid) FROM jobs WHERE {ACTIVE} GROUP BY key)",
+                           (FAILED, "Duplicate of another active job"))
+                db.execute(ACTIVE_KEY_INDEX)
+        finally:
+            db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.database, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def get(self, job_id):
+        db = self.connect()
+        try:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            db.close()
+        return dict(row) if row else None
+
+    def job_alive(self, row):
+        if row['owner'] == self.owner:
+            return row['id'] in self.active
+        return process_alive(row['owner'])
+
+    def fail_stale_jobs(self, db, key=None):
+        """Mark the active jobs (of key, if given) whose owner process is gone as failed."""
+        query = f"SELECT * FROM jobs WHERE {ACTIVE}" + (" AND key = ?" if key else "")
+        for row in db.execute(query, (key,) if key else ()).fetchall():
+            if not self.job_alive(row):
+                logging.warning(f"Patch job {row['id']} was left {row['status']} by {row['owner']}, marking it failed")
+                db.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                           (FAILED, "Interrupted: the server process running it exited",
+                            datetime.now().isoformat(), row['id']))
+
+    def submit(self, source_sha256, spec, api):
+        key = f"{source_sha256}:{spec.name}:{api}"
+        job_id = uuid.uuid4().hex
+        db = self.connect()
+        try:
+            with db:
+                artifact = db.execute('SELECT * FROM artifacts WHERE source = ? AND jar = ? AND api = ?',
+                                      (source_sha256, spec.name, api)).fetchone()
+                if artifact and os.path.exists(os.path.join(self.blob_store.directory, artifact['artifact'])):
+                    return self.get(artifact['job_id'])
+                self.fail_stale_jobs(db, key)
+                inserted = db.execute(
+                    f"INSERT INTO jobs (id, key, jar, api, status, created, owner) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    f"ON CONFLICT (key) WHERE {ACTIVE} DO NOTHING",
+                    (job_id, key, spec.name, api, QUEUED, datetime.now().isoformat(), self.owner)).rowcount
+                if not inserted:
+                    return dict(db.execute(f"SELECT * FROM jobs WHERE key = ? AND {ACTIVE}", (key,)).fetchone())
+                self.active.add(job_id)
+        finally:
+            db.close()
+        workspace = os.path.join(self.jobs_dir, job_id)
+        try:
+            os.makedirs(workspace)
+            source = self.blob_store.path(source_sha256)
+            try:
+                os.link(source, os.path.join(workspace, spec.jar))
+            except OSError:
+                shutil.copyfile(source, os.path.join(workspace, spec.jar))
+            self.executor.submit(self.run, job_id, workspace, spec, api, source_sha256)
+        except Exception as e:
+            self.active.discard(job_id)
+            self.update(job_id, status=FAILED, error=str(e), finished=datetime.now().isoformat())
+            raise
+        return self.get(job_id)
+
+    def update(self, job_id, **fields):
+        db = self.connect()
+        try:
+            with db:
+                db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                           (*fields.values(), job_id))
+        finally:
+            db.close()
+
+    def run(self, job_id, workspace, spec, api, source_sha256):
+        self.update(job_id, status=RUNNING)
+        cpus = max((os.cpu_count() or 1) // self.workers, 1)
+        args = [sys.executable, os.path.join(ROOT_DIR, 'pipeline.py'), '--api', api, '--jobs', str(cpus),
+                '--baksmali', BAKSMALI, '--smali', SMALI, spec.name]
+        try:
+            result = subprocess.run(args, cwd=workspace, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            with open(os.path.join(self.jobs_dir, f"{job_id}.log"), 'w') as log:
+                log.write(result.stdout)
+            if result.returncode != 0:
+                raise RuntimeError(f"pipeline.py failed with exit code {result.returncode}")
+            patched = os.path.join(workspace, spec.install_path)
+            artifact_sha256 = file_sha256(patched)
+            self.blob_store.put_file(patched, artifact_sha256)
+            db = self.connect()
+            try:
+                with db:
+                    db.execute('INSERT OR REPLACE INTO artifacts (source, jar, api, artifact, job_id) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (source_sha256, spec.name, api, self.blob_store.name(artifact_sha256), job_id))
+            finally:
+                db.close()
+            self.update(job_id, status=DONE, result=self.blob_store.name(artifact_sha256),
+                        finished=datetime.now().isoformat())
+        except Exception as e:
+            logging.exception(f"Patch job {job_id} failed")
+            self.update(job_id, status=FAILED, error=str(e), finished=datetime.now().isoformat())
+        finally:
+            self.active.discard(job_id)
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    def result_path(self, job):
+        return os.path.join(self.blob_store.directory, job['result'])
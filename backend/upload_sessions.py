@@ -0,0 +1,112 @@
+import os
+import uuid
+import sqlite3
+import hashlib
+from datetime import datetime
+
+from blob_store import CHUNK_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT,
+    created TEXT NOT NULL
+);
+"""
+
+
+class UploadSessions:
+    """
+    Resumable uploads: a session is a .part file in the blob store directory
+    that chunks are written into at their offset, straight from the request
+    stream, so memory use does not depend on the file size. Sessions are
+    kept in SQLite so any worker process can take the next chunk.
+    """
+
+    def __init__(self, database, blob_store):
+        self.database = database
+        self.blob_store = blob_store
+        self.directory = os.path.join(blob_store.directory, '.sessions')
+        os.makedirs(self.directory, exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    def connect(self):
+        db = sqlite3.connect(self.database, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def part_path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.part")
+
+    def create(self, filename, size, sha256=None):
+        session_id = uuid.uuid4().hex
+        db = self.connect()
+        try:
+            with db:
+                db.execute('INSERT INTO upload_sessions (id, filename, size, sha256, created) VALUES (?, ?, ?, ?, ?)',
+                           (session_id, filename, size, sha256, datetime.now().isoformat()))
+        finally:
+            db.close()
+        open(self.part_path(session_id), 'wb').close()
+        return self.get(session_id)
+
+    def get(self, session_id):
+        db = self.connect()
+        try:
+            row = db.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+        finally:
+            db.close()
+        if not row or not os.path.exists(self.part_path(session_id)):
+            return None
+        session = dict(row)
+        session['offset'] = os.path.getsize(self.part_path(session_id))
+        return session
+
+    def write(self, session, offset, stream):
+        """
+        Write stream into the session at offset and return the new offset.
+        Chunks may be resent (offset before the current end) but not leave
+        a gap, and the file may not grow past its declared size.
+        """
+        if offset > session['offset']:
+            raise ValueError(f"Offset {offset} is past the uploaded {session['offset']} bytes")
+        with open(self.part_path(session['id']), 'r+b') as file:
+            file.seek(offset)
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                if file.tell() + len(chunk) > session['size']:
+                    raise ValueError(f"Chunk goes past the declared size of {session['size']} bytes")
+                file.write(chunk)
+            return max(file.tell(), session['offset'])
+
+    def finalize(self, session, sha256=None):
+        """
+        Check the complete file against its SHA-256 and move it into the blob
+        store. Returns (sha256, new); raises ValueError if it is incomplete
+        or does not match.
+        """
+        part_path = self.part_path(session['id'])
+        if session['offset'] != session['size']:
+            raise ValueError(f"Upload incomplete: {session['offset']} of {session['size']} bytes")
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        expected = sha256 or session['sha256']
+        if expected and digest.hexdigest() != expected:
+            raise ValueError(f"SHA-256 mismatch: expected {expected}, got {digest.hexdigest()}")
+        new = self.blob_store.put_file(part_path, digest.hexdigest())
+        self.delete(session['id'])
+        return digest.hexdigest(), new
+
+    def delete(self, session_id):
+        db = self.connect()
+        try:
+            with db:
+                db.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+        finally:
+            db.close()
+        if os.path.exists(self.part_path(session_id)):
+            os.remove(self.part_path(session_id))
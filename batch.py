@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import zipfile
+import argparse
+
+from pipeline import JARS, Build
+from smali_utils import file_sha256
+
+# Manifest: a JSON list of entries (or {"entries": [...]}), one per firmware
+# build, e.g.
+#   {"device": "garnet", "version": "OS2.0.5.0", "api": "35",
+#    "jars": {"framework": "garnet/framework.jar", "services": "...", "miui-services": "..."}}
+# Jar paths are relative to the manifest. Each entry gets <device>_<version>.zip.
+SPECS = {spec.name: spec for spec in JARS}
+
+
+def load_manifest(path):
+    with open(path) as file:
+        manifest = json.load(file)
+    entries = manifest['entries'] if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(path))
+    seen = set()
+    for entry in entries:
+        for key in ('device', 'version', 'jars'):
+            if key not in entry:
+                raise ValueError(f"Manifest entry {entry} has no {key}")
+        # Both would write bundle:<device>_<version>.
+        if (entry['device'], entry['version']) in seen:
+            raise ValueError(f"Manifest lists {entry['device']} {entry['version']} more than once")
+        seen.add((entry['device'], entry['version']))
+        unknown = set(entry['jars']) - set(SPECS)
+        if unknown:
+            raise ValueError(f"Unknown jar in {entry['device']} {entry['version']}: {', '.join(sorted(unknown))}")
+        entry['api'] = str(entry.get('api', '35'))
+        entry['jars'] = {name: os.path.join(base_dir, jar_path) for name, jar_path in entry['jars'].items()}
+    return entries
+
+
+def link_or_copy(source, target):
+    if os.path.exists(target):
+        return
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def write_bundle(bundle_path, files):
+    """Zip {archive name: file} into bundle_path, the layout the workflow releases."""
+    tmp_path = f"{bundle_path}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, path in sorted(files.items()):
+            bundle.write(path, name)
+    os.replace(tmp_path, bundle_path)
+    logging.info(f"Wrote {bundle_path}")
+
+
+def schedule(build, entries, work_dir, out_dir):
+    """
+    Add every entry to one job graph. A jar is built once per content and
+    API level, in work_dir/<jar>-<sha256>-<api>, however many entries list
+    it; each entry's bundle job waits for the builds of its jars.
+    """
+    builds = {}
+    for entry in entries:
+        files = {}
+        repacks = []
+        for name, jar_path in sorted(entry['jars'].items()):
+            spec = SPECS[name]
+            tag = f"{name}-{file_sha256(jar_path)[:16]}-{entry['api']}"
+            workdir = os.path.join(work_dir, tag)
+            if tag not in builds:
+                os.makedirs(workdir, exist_ok=True)
+                link_or_copy(jar_path, os.path.join(workdir, spec.jar))
+                builds[tag] = build.add_jar(spec, workdir, entry['api'], tag)
+            else:
+                logging.info(f"{jar_path} is the same jar as an earlier entry, building it once")
+            files[spec.install_path] = os.path.join(workdir, spec.install_path)
+            repacks.append(builds[tag])
+        bundle_path = os.path.join(out_dir, f"{entry['device']}_{entry['version']}.zip")
+        build.graph.add(f"bundle:{entry['device']}_{entry['version']}",
+                        lambda b=bundle_path, f=files: write_bundle(b, f), repacks)
+    return builds
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Patch the jars of many firmware builds on one job graph.")
+    parser.add_argument('manifest', help="JSON manifest of device, version, api and jars per build")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="number of concurrent jobs")
+    parser.add_argument('--baksmali', default='baksmali.jar')
+    parser.add_argument('--smali', default='smali.jar')
+    parser.add_argument('--no-dex-patch', action='store_true',
+                        help="always decompile with baksmali instead of stubbing methods in the dex first")
+    parser.add_argument('--work-dir', default='batch_work', help="where each distinct jar is built")
+    parser.add_argument('--out', default='out', help="where the release bundles are written")
+    options = parser.parse_args(args)
+    options.api = None  # every entry has its own
+
+    entries = load_manifest(options.manifest)
+    os.makedirs(options.out, exist_ok=True)
+    build = Build(options)
+    builds = schedule(build, entries, options.work_dir, options.out)
+    logging.info(f"{len(entries)} builds, {len(builds)} distinct jars to patch")
+    try:
+        build.graph.run()
+    finally:
+        build.graph.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,236 @@
+import os
+import sys
+import random
+import argparse
+
+# Synthetic decompiled trees for benchmarking the patch scripts. Filler
+# classes look like baksmali output (fields, .line directives, labels and
+# record-style invoke-custom call sites) and the real target classes carry
+# the anchor lines the rules look for, so every rule fires like on a real jar.
+
+FILLER_INSTRUCTIONS = [
+    "    const/4 v0, 0x0\n",
+    "    const-string v1, \"value\"\n",
+    "    iget-object v2, p0, L{cls};->mName:Ljava/lang/String;\n",
+    "    invoke-virtual {{p0}}, Ljava/lang/Object;->hashCode()I\n",
+    "    move-result v0\n",
+    "    invoke-static {{v1}}, Landroid/text/TextUtils;->isEmpty(Ljava/lang/CharSequence;)Z\n",
+    "    move-result v3\n",
+    "    if-eqz v3, :cond_{label}\n",
+    "    add-int/lit8 v0, v0, 0x1\n",
+    "    :cond_{label}\n",
+    "    .line {line}\n",
+    "    new-instance v4, Ljava/lang/StringBuilder;\n",
+    "    invoke-direct {{v4}}, Ljava/lang/StringBuilder;-><init>()V\n",
+]
+
+INVOKE_CUSTOM_LINES = [
+    "    invoke-custom {{p0}}, call_site_{label}(\"equals\", (L{cls};Ljava/lang/Object;)Z, \"mName\")@"
+    "Ljava/lang/runtime/ObjectMethods;->bootstrap(Ljava/lang/invoke/MethodHandles$Lookup;Ljava/lang/String;"
+    "Ljava/lang/invoke/TypeDescriptor;Ljava/lang/Class;Ljava/lang/String;[Ljava/lang/invoke/MethodHandle;)"
+    "Ljava/lang/Object;\n",
+    "    move-result v0\n",
+]
+
+THROWS_CERTIFICATE_EXCEPTION = (
+    "    .annotation system Ldalvik/annotation/Throws;\n"
+    "        value = {\n"
+    "            Ljava/security/cert/CertificateException;\n"
+    "        }\n"
+    "    .end annotation\n"
+)
+
+
+def method(signature, body, registers=6):
+    return f".method {signature}\n    .registers {registers}\n\n{body}.end method\n\n"
+
+
+def class_header(descriptor, source):
+    return (f".class public {descriptor}\n.super Ljava/lang/Object;\n.source \"{source}\"\n\n"
+            f"# instance fields\n.field private mName:Ljava/lang/String;\n\n.field private mFlags:I\n\n\n"
+            f"# direct methods\n")
+
+
+def filler_body(rng, cls, lines):
+    body = []
+    for line in range(lines):
+        template = rng.choice(FILLER_INSTRUCTIONS)
+        body.append(template.format(cls=cls, label=line // 4, line=line + 10))
+    return body
+
+
+def filler_class(rng, descriptor, methods, method_lines, invoke_custom):
+    cls = descriptor[1:-1]
+    text = [class_header(descriptor, descriptor.rsplit('/', 1)[-1][:-1] + ".java")]
+    text.append(method("public constructor <init>()V",
+                       "    invoke-direct {p0}, Ljava/lang/Object;-><init>()V\n\n    return-void\n", 1))
+    if invoke_custom:
+        for name, proto, ret in (("equals", "(Ljava/lang/Object;)Z", "return v0"),
+                                 ("hashCode", "()I", "return v0"),
+                                 ("toString", "()Ljava/lang/String;", "return-object v0")):
+            body = ''.join(line.format(cls=cls, label=rng.randrange(1000)) for line in INVOKE_CUSTOM_LINES)
+            text.append(method(f"public final {name}{proto}", body + f"    {ret}\n", 2))
+    text.append("\n# virtual methods\n")
+    for index in range(methods):
+        lines = rng.randint(*method_lines)
+        body = ''.join(filler_body(rng, cls, lines))
+        text.append(method(f"public method{index}(Ljava/lang/String;I)I", body + "    return v0\n"))
+    return ''.join(text)
+
+
+FILLER = "    const/4 v0, 0x0\n    invoke-virtual {p0}, Ljava/lang/Object;->hashCode()I\n    move-result v1\n"
+
+# Real anchors, by decompiled directory prefix: {relative path: methods}.
+TARGETS = {
+    'classes': {
+        'android/content/pm/SigningDetails.smali':
+            method("public checkCapability(Landroid/content/pm/SigningDetails;I)Z", FILLER + "    return v0\n")
+            + method("public checkCapabilityRecover(Landroid/content/pm/SigningDetails;I)Z",
+                     THROWS_CERTIFICATE_EXCEPTION + FILLER + "    return v0\n")
+            + method("public hasAncestorOrSelf(Landroid/content/pm/SigningDetails;)Z", FILLER + "    return v0\n"),
+        'android/content/pm/PackageParser$SigningDetails.smali':
+            method("public checkCapability(Landroid/content/pm/PackageParser$SigningDetails;I)Z",
+                   FILLER + "    return v0\n"),
+        'android/util/apk/ApkSignatureVerifier.smali':
+            method("public static getMinimumSignatureSchemeVersionForTargetSdk(I)I", FILLER + "    return v0\n")
+            + method("private static verifyV1(Landroid/content/pm/parsing/result/ParseInput;)"
+                     "Landroid/content/pm/parsing/result/ParseResult;",
+                     "    invoke-static {p0, p1, p3}, Landroid/util/apk/ApkSignatureVerifier;->verifyV1Signature("
+                     "Landroid/content/pm/parsing/result/ParseInput;Ljava/lang/String;Z)"
+                     "Landroid/content/pm/parsing/result/ParseResult;\n    move-result-object v0\n"
+                     "    return-object v0\n"),
+        'android/util/apk/ApkSignatureSchemeV2Verifier.smali':
+            method("private static verify()V", "    invoke-static {v1, v2}, Ljava/security/MessageDigest;->isEqual([B[B)Z\n"
+                   "\n    move-result v3\n    return-void\n"),
+        'android/util/apk/ApkSignatureSchemeV3Verifier.smali':
+            method("private static verify()V", "    invoke-static {v1, v2}, Ljava/security/MessageDigest;->isEqual([B[B)Z\n"
+                   "    move-result v4\n    return-void\n"),
+        'android/util/apk/ApkSigningBlockUtils.smali':
+            method("private static verify()V", "    invoke-static {v1, v2}, Ljava/security/MessageDigest;->isEqual([B[B)Z\n"
+                   "    move-result v5\n    return-void\n"),
+        'android/content/pm/PackageParser.smali':
+            method("private static parse()V",
+                   "    invoke-static {v2, v0, v1}, Landroid/util/apk/ApkSignatureVerifier;->"
+                   "unsafeGetCertsWithoutVerification(Landroid/content/pm/parsing/result/ParseInput;Ljava/lang/String;I)"
+                   "Landroid/content/pm/parsing/result/ParseResult;\n    move-result-object v0\n"
+                   "    if-nez v5, :cond_3\n    nop\n"
+                   "    const-string v1, \"<manifest> specifies bad sharedUserId name \\\"\"\n    return-void\n"),
+        'android/content/pm/PackageParser$PackageParserException.smali':
+            method("public constructor <init>(I)V",
+                   "    iput p1, p0, Landroid/content/pm/PackageParser$PackageParserException;->error:I\n"
+                   "    return-void\n"),
+        'android/util/jar/StrictJarVerifier.smali':
+            method("private static blacklist verifyMessageDigest([B[B)Z",
+                   "    const/4 v1, 0x0\n    invoke-static {v1, v2}, Ljava/security/MessageDigest;->isEqual([B[B)Z\n"
+                   "    move-result v0\n    return v0\n"),
+        'com/android/internal/pm/pkg/parsing/ParsingPackageUtils.smali':
+            method("private static parseSharedUser(Landroid/content/pm/parsing/result/ParseInput;)V",
+                   "    if-eqz v3, :cond_1\n    if-eqz v4, :cond_2\n"
+                   "    const-string v0, \"<manifest> specifies bad sharedUserId name \\\"\"\n    return-void\n"),
+        'android/util/jar/StrictJarFile.smali':
+            method("public getCertificates()V",
+                   "    invoke-virtual {p0, v5}, Landroid/util/jar/StrictJarFile;->findEntry(Ljava/lang/String;)"
+                   "Ljava/util/zip/ZipEntry;\n    move-result-object v6\n    if-eqz v6, :cond_56\n"
+                   "    const/4 v0, 0x1\n    :cond_56\n    return-void\n"),
+        'android/content/pm/ApplicationInfo.smali':
+            method("public isPackageWhitelistedForHiddenApis()Z", FILLER + "    return v0\n"),
+    },
+    'services_classes': {
+        'com/android/server/pm/PackageManagerServiceUtils.smali':
+            method("public static checkDowngrade(Lcom/android/server/pm/pkg/AndroidPackage;"
+                   "Landroid/content/pm/PackageInfoLite;)V", FILLER + "    return-void\n")
+            + method("public static verifySignatures(Lcom/android/server/pm/PackageSetting;"
+                     "Lcom/android/server/pm/SharedUserSetting;Lcom/android/server/pm/PackageSetting;"
+                     "Landroid/content/pm/SigningDetails;ZZZ)Z", FILLER + "    return v0\n")
+            + method("public static compareSignatures(Landroid/content/pm/SigningDetails;"
+                     "Landroid/content/pm/SigningDetails;)I", FILLER + "    return v0\n")
+            + method("private static matchSignaturesCompat(Ljava/lang/String;)Z", FILLER + "    return v0\n"),
+        'com/android/server/pm/KeySetManagerService.smali':
+            method("public shouldCheckUpgradeKeySetLocked(Lcom/android/server/pm/pkg/PackageStateInternal;"
+                   "Lcom/android/server/pm/pkg/SharedUserApi;I)Z", FILLER + "    return v0\n"),
+        'com/android/server/pm/InstallPackageHelper.smali':
+            method("private preparePackageLI(Lcom/android/server/pm/InstallRequest;)V",
+                   "    if-eqz v3, :cond_1\n    if-eqz v9, :cond_2\n"
+                   "    invoke-interface {v7}, Lcom/android/server/pm/pkg/AndroidPackage;->isLeavingSharedUser()Z\n"
+                   "    return-void\n"),
+        'com/android/server/pm/ReconcilePackageUtils.smali':
+            method("public static reconcilePackages()V",
+                   "    invoke-static {}, Lcom/android/internal/hidden_from_bootclasspath/android/content/pm/Flags;"
+                   "->restrictNonpreloadsSystemShareduids()Z\n    move-result v1\n    const/4 v0, 0x0\n"
+                   "    return-void\n"),
+    },
+    'miui_services_classes': {
+        'com/android/server/pm/PackageManagerServiceImpl.smali':
+            method("private updateDefaultPkgInstallerLocked()Z",
+                   "    sget-boolean v0, Lcom/android/server/pm/PackageManagerServiceImpl;->IS_INTERNATIONAL_BUILD:Z\n"
+                   "    return v0\n"),
+    },
+}
+
+PACKAGES = {
+    'classes': 'android/app/synthetic',
+    'services_classes': 'com/android/server/synthetic',
+    'miui_services_classes': 'com/miui/server/synthetic',
+}
+
+
+def dex_dirs(prefix, count):
+    return [prefix] + [f"{prefix}{index}" for index in range(2, count + 1)]
+
+
+def generate(root, classes=2000, dex_count=3, invoke_custom_share=0.05, methods=(2, 12), method_lines=(4, 60),
+             seed=1):
+    """
+    Write a corpus under root with `classes` filler classes per jar, spread
+    over dex_count directories (miui_services_classes always gets one).
+    Returns the number of smali files written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    for prefix, package in PACKAGES.items():
+        directories = dex_dirs(prefix, 1 if prefix == 'miui_services_classes' else dex_count)
+        for index in range(classes):
+            directory = directories[index % len(directories)]
+            relative_path = f"{package}/p{index % 64}/C{index}.smali"
+            descriptor = f"L{relative_path[:-len('.smali')]};"
+            text = filler_class(rng, descriptor, rng.randint(*methods), method_lines,
+                                rng.random() < invoke_custom_share)
+            write(root, directory, relative_path, text)
+            written += 1
+        for relative_path, body in TARGETS[prefix].items():
+            descriptor = f"L{relative_path[:-len('.smali')]};"
+            write(root, directories[-1], relative_path, class_header(descriptor, "Target.java") + body)
+            written += 1
+    return written
+
+
+def write(root, directory, relative_path, text):
+    path = os.path.join(root, directory, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Generate a synthetic smali corpus for the benchmarks.")
+    parser.add_argument('root', help="output directory")
+    parser.add_argument('--classes', type=int, default=2000, help="filler classes per jar")
+    parser.add_argument('--dex', type=int, default=3, help="classesN directories per jar")
+    parser.add_argument('--invoke-custom', type=float, default=0.05, help="share of classes using invoke-custom")
+    parser.add_argument('--methods', type=parse_range, default=(2, 12), help="methods per class, e.g. 2-12")
+    parser.add_argument('--method-lines', type=parse_range, default=(4, 60), help="lines per method, e.g. 4-60")
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args(args)
+    written = generate(options.root, options.classes, options.dex, options.invoke_custom, options.methods,
+                       options.method_lines, options.seed)
+    print(f"Wrote {written} smali files to {options.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
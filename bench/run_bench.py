@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import gen_corpus  # noqa: E402
+from smali_utils import find_class_dirs, iter_smali_files  # noqa: E402
+
+# Anchor and pass rules run in memory over every file of the corpus, as
+# (module, function of the rule). They only change the files that contain their anchors or
+# methods, but like on a real jar they are timed against everything.
+LINE_PATCHERS = [
+    ('framework_patch', 'modify_invoke_static'),
+    ('framework_patch', 'modify_strict_jar_verifier'),
+    ('framework_patch', 'modify_Parsing_Package_Utils_sharedUserId'),
+    ('framework_patch', 'modify_android_content_pm_PackageParser'),
+    ('framework_patch', 'modify_strict_jar_file'),
+    ('services_patch', 'modify_install_package_helper'),
+    ('services_patch', 'modify_reconcile_package_utils'),
+    ('miui-service_Patch', 'modify_updateDefaultPkgInstallerLocked'),
+]
+
+# Patch scripts run end to end, with the directory prefix they patch.
+SCRIPTS = {
+    'framework_patch.py': 'classes',
+    'services_patch.py': 'services_classes',
+    'miui-service_Patch.py': 'miui_services_classes',
+}
+
+
+def corpus_files(corpus, prefix=None):
+    directories = find_class_dirs(prefix, corpus) if prefix else [corpus]
+    return sorted(path for directory in directories for path in iter_smali_files(directory))
+
+
+def invoke_custom_rules(smali):
+    from smali_rules import INVOKE_CUSTOM_COMPILED, apply_method_rules
+    apply_method_rules(smali, INVOKE_CUSTOM_COMPILED)
+
+
+def load_patcher(name):
+    """Return a function that applies the named benchmark to a SmaliFile."""
+    from smali_rules import apply_rules, compile_target
+    if name == 'invoke-custom-rules':
+        return invoke_custom_rules
+    module, function = name.split(':')
+    module = importlib.import_module(module)
+    rule = next(rule for rule in module.RULES if getattr(rule, 'func', None) is getattr(module, function))
+    compiled = compile_target([rule])
+    return lambda smali: apply_rules(smali, compiled)
+
+
+def run_line_patcher(name, corpus, repeat):
+    """Time a rule over the corpus already read into memory, on a fresh SmaliFile per file."""
+    from smali_model import SmaliFile
+    func = load_patcher(name)
+    files = []
+    for path in corpus_files(corpus):
+        with open(path, 'rb') as file:
+            files.append(file.read())
+    size = sum(len(data) for data in files)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in files:
+            func(SmaliFile(data))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(files), size, best
+
+
+def run_patch(corpus, repeat, scratch):
+    """Time smali_rules.patch, including its reads and writes, on a fresh copy of the corpus."""
+    from smali_rules import patch
+    best = None
+    for _ in range(repeat):
+        shutil.rmtree(scratch, ignore_errors=True)
+        shutil.copytree(corpus, scratch)
+        os.chdir(scratch)  # patch() journals into the current directory
+        files = corpus_files(scratch)
+        size = sum(os.path.getsize(path) for path in files)
+        start = time.perf_counter()
+        for path in files:
+            patch(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(files), size, best
+
+
+def run_one(name, corpus, repeat, scratch):
+    """Child mode: run one benchmark and print its result as JSON."""
+    logging.disable(logging.CRITICAL)
+    if name == 'patch':
+        files, size, seconds = run_patch(corpus, repeat, scratch)
+    else:
+        files, size, seconds = run_line_patcher(name, corpus, repeat)
+    print(json.dumps({'files': files, 'bytes': size, 'seconds': seconds}))
+
+
+def measure(args, cwd=None):
+    """Run a child process and return (stdout, wall seconds, peak RSS in KiB)."""
+    start = time.perf_counter()
+    process = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)  # like wait(), but with the child's rusage
+    elapsed = time.perf_counter() - start
+    process.stdout.close()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed with exit code {process.returncode}")
+    return output, elapsed, usage.ru_maxrss
+
+
+def run_benchmarks(corpus, names, repeat, workers, work_dir):
+    """
+    Run every benchmark in its own process, so peak RSS is per patcher
+    (for scripts, of the largest process including pool workers).
+    Returns {name: {files, bytes, seconds, files_per_s, mb_per_s, peak_rss_kib}}.
+    """
+    results = {}
+    for name in names:
+        if name in SCRIPTS:
+            files = corpus_files(corpus, SCRIPTS[name])
+            size = sum(os.path.getsize(path) for path in files)
+            best = None
+            for _ in range(repeat):
+                scratch = os.path.join(work_dir, 'script')
+                shutil.rmtree(scratch, ignore_errors=True)
+                shutil.copytree(corpus, scratch)
+                _, seconds, rss = measure([sys.executable, os.path.join(ROOT_DIR, name), str(workers)], scratch)
+                best = min(best, (seconds, rss)) if best else (seconds, rss)
+            result = {'files': len(files), 'bytes': size, 'seconds': best[0], 'peak_rss_kib': best[1]}
+        else:
+            output, _, rss = measure([sys.executable, __file__, '--one', name, '--repeat', str(repeat),
+                                      '--scratch', os.path.join(work_dir, 'patch'), corpus])
+            result = dict(json.loads(output), peak_rss_kib=rss)
+        result['files_per_s'] = result['files'] / result['seconds'] if result['seconds'] else 0
+        result['mb_per_s'] = result['bytes'] / result['seconds'] / 1e6 if result['seconds'] else 0
+        results[name] = result
+        print(f"{name:<56} {result['files_per_s']:10.0f} files/s {result['mb_per_s']:8.1f} MB/s "
+              f"{result['peak_rss_kib'] / 1024:8.1f} MiB", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change in throughput against baseline and return the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<56} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['mb_per_s'], result['mb_per_s']
+        change = (after - before) / before if before else 0
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<56} {before:10.1f} {after:10.1f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main(args):
+    names = (['patch', 'invoke-custom-rules'] + [f"{module}:{function}" for module, function in LINE_PATCHERS]
+             + list(SCRIPTS))
+    parser = argparse.ArgumentParser(description="Benchmark the patchers on a synthetic smali corpus.")
+    parser.add_argument('corpus', nargs='?', help="corpus generated by gen_corpus.py (default: generate one)")
+    parser.add_argument('--classes', type=int, default=2000, help="filler classes per jar for a generated corpus")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark, the fastest one counts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker count passed to scripts")
+    parser.add_argument('--only', action='append', choices=names, help="run only this benchmark (repeatable)")
+    parser.add_argument('--save', help="write the results as JSON, e.g. to use as a baseline")
+    parser.add_argument('--baseline', help="compare against results saved with --save")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown against the baseline that counts as a regression (default 0.10)")
+    parser.add_argument('--one', help=argparse.SUPPRESS)
+    parser.add_argument('--scratch', help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    if options.one:
+        run_one(options.one, options.corpus, options.repeat, options.scratch)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix='a15-bench-') as work_dir:
+        # Scripts and patch() journal and cache relative to where they run.
+        os.environ['PATCHER_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+        corpus = options.corpus
+        if not corpus:
+            corpus = os.path.join(work_dir, 'corpus')
+            written = gen_corpus.generate(corpus, options.classes)
+            print(f"Generated {written} smali files in {corpus}")
+        corpus = os.path.abspath(corpus)
+        results = run_benchmarks(corpus, options.only or names, options.repeat, options.workers, work_dir)
+
+    if options.save:
+        with open(options.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(results, json.load(file), options.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks regressed by more than {options.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+from smali_utils import CACHE_DIR, file_sha256
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEX_CACHE_DIR = os.path.join(CACHE_DIR, 'dex')
+MAX_CACHE_BYTES = int(os.environ.get('PATCHER_DEX_CACHE_MAX', 4 << 30))
+PENDING_FILE = 'dex_cache_pending.json'
+
+# Everything that decides what a patched dex looks like.
+RULESET_SOURCES = [
+    'framework_patch.py',
+    'services_patch.py',
+    'miui-service_Patch.py',
+    'smali_rules.py',
+    'smali_model.py',
+    'smali_utils.py',
+    'dex_file.py',
+    'dex_patch.py',
+]
+
+
+def ruleset_version():
+    sha256 = hashlib.sha256()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in RULESET_SOURCES:
+        with open(os.path.join(base_dir, name), 'rb') as file:
+            sha256.update(file.read())
+    return sha256.hexdigest()
+
+
+def build_settings(tools, dex_patch=True):
+    """
+    The rest of what decides a patched dex: whether methods may be stubbed
+    in the dex itself, and the smali/baksmali jars (by SHA-256) that
+    rebuild the others.
+    """
+    versions = [file_sha256(tool) if os.path.isfile(tool) else tool for tool in tools]
+    return ':'.join([f"dex-patch={int(dex_patch)}"] + versions)
+
+
+def cache_path(dex_sha256, api_level, ruleset, settings):
+    key = hashlib.sha256(f"{dex_sha256}:{ruleset}:{api_level}:{settings}".encode()).hexdigest()
+    return os.path.join(DEX_CACHE_DIR, f"{key}.dex")
+
+
+def restore(dex_paths, api_level, settings):
+    """
+    Replace every dex that has a cached patched version with it. settings
+    comes from build_settings(). Returns {dex path: cache path} for the
+    misses, to be passed to store() once they are patched.
+    """
+    ruleset = ruleset_version()
+    pending = {}
+    for dex_path in dex_paths:
+        cached = cache_path(file_sha256(dex_path), api_level, ruleset, settings)
+        if os.path.exists(cached):
+            logging.info(f"Cache hit for {dex_path}")
+            shutil.copyfile(cached, dex_path)
+            os.utime(cached)  # keeps eviction least-recently-used
+            continue
+        logging.info(f"Cache miss for {dex_path}")
+        pending[dex_path] = cached
+    return pending
+
+
+def store(pending, max_bytes=MAX_CACHE_BYTES):
+    """Cache the patched bytes of every dex returned by restore(), then evict."""
+    os.makedirs(DEX_CACHE_DIR, exist_ok=True)
+    for dex_path, cached in pending.items():
+        if not os.path.exists(dex_path):
+            logging.warning(f"File not found: {dex_path}")
+            continue
+        tmp_file = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(dex_path, tmp_file)
+        os.replace(tmp_file, cached)
+        logging.info(f"Cached {dex_path}")
+    evict(max_bytes)
+
+
+def load_pending():
+    try:
+        with open(PENDING_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    if not os.path.isdir(DEX_CACHE_DIR):
+        return
+    entries = []
+    for name in os.listdir(DEX_CACHE_DIR):
+        path = os.path.join(DEX_CACHE_DIR, name)
+        if name.endswith('.tmp'):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # evicted by a concurrent run
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            logging.info(f"Evicted {path}")
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def main(args):
+    if len(args) >= 4 and args[0] == 'restore':
+        # The baksmali-only path: every dex is decompiled, none is patched in place.
+        misses = restore(args[4:], args[1], build_settings(args[2:4], dex_patch=False))
+        with open(PENDING_FILE, 'w') as file:
+            json.dump({**load_pending(), **misses}, file, indent=2)
+        for dex_path in misses:
+            print(dex_path)
+        return 0
+    if len(args) == 1 and args[0] == 'store':
+        pending = load_pending()
+        if not pending:
+            logging.warning(f"{PENDING_FILE} not found, nothing to cache")
+        store(pending)
+        if os.path.exists(PENDING_FILE):
+            os.remove(PENDING_FILE)
+        return 0
+    if len(args) in (1, 2) and args[0] == 'evict':
+        evict(int(args[1]) if len(args) == 2 else MAX_CACHE_BYTES)
+        return 0
+    print("usage: dex_cache.py restore <api-level> <smali.jar> <baksmali.jar> <classes.dex>... | store | "
+          "evict [max-bytes]", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
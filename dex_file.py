@@ -0,0 +1,269 @@
+import struct
+import hashlib
+import zlib
+
+NO_INDEX = 0xffffffff
+TYPE_CALL_SITE_ID_ITEM = 0x0007
+TYPE_HIDDENAPI_CLASS_DATA_ITEM = 0xf000
+
+METHOD_ACCESS_FLAGS = [
+    (0x1, 'public'),
+    (0x2, 'private'),
+    (0x4, 'protected'),
+    (0x8, 'static'),
+    (0x10, 'final'),
+    (0x20, 'synchronized'),
+    (0x40, 'bridge'),
+    (0x80, 'varargs'),
+    (0x100, 'native'),
+    (0x400, 'abstract'),
+    (0x800, 'strictfp'),
+    (0x1000, 'synthetic'),
+    (0x10000, 'constructor'),
+    (0x20000, 'declared-synchronized'),
+]
+
+# hiddenapi_class_data flags as baksmali prints them after the access flags:
+# the low three bits are the restriction, the bits above are API domains.
+HIDDENAPI_RESTRICTIONS = ['whitelist', 'greylist', 'blacklist', 'greylist-max-o', 'greylist-max-p',
+                          'greylist-max-q', 'greylist-max-r']
+HIDDENAPI_DOMAINS = [(0x8, 'core-platform-api'), (0x10, 'test-api')]
+
+INVOKE_CUSTOM_OPCODES = (0xfc, 0xfd)
+
+
+def _instruction_widths():
+    """Width in 16-bit code units of every opcode, indexed by opcode."""
+    widths = [1] * 256
+    ranges = [
+        (0x02, 0x02, 2), (0x03, 0x03, 3), (0x05, 0x05, 2), (0x06, 0x06, 3), (0x08, 0x08, 2), (0x09, 0x09, 3),
+        (0x13, 0x13, 2), (0x14, 0x14, 3), (0x15, 0x16, 2), (0x17, 0x17, 3), (0x18, 0x18, 5), (0x19, 0x1a, 2),
+        (0x1b, 0x1b, 3), (0x1c, 0x1c, 2), (0x1f, 0x20, 2), (0x22, 0x23, 2), (0x24, 0x26, 3), (0x29, 0x29, 2),
+        (0x2a, 0x2c, 3), (0x2d, 0x3d, 2), (0x44, 0x6d, 2), (0x6e, 0x72, 3), (0x74, 0x78, 3), (0x90, 0xaf, 2),
+        (0xd0, 0xe2, 2), (0xfa, 0xfb, 4), (0xfc, 0xfd, 3), (0xfe, 0xff, 2),
+    ]
+    for first, last, width in ranges:
+        for opcode in range(first, last + 1):
+            widths[opcode] = width
+    return widths
+
+
+INSTRUCTION_WIDTHS = _instruction_widths()
+
+
+def read_uleb128(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def decode_mutf8(data):
+    # Modified UTF-8 only differs from UTF-8 in how it encodes NUL and
+    # supplementary characters, neither of which appear in class or method names.
+    return data.replace(b'\xc0\x80', b'\x00').decode('utf-8', errors='surrogatepass')
+
+
+def iter_instructions(insns):
+    """Yield (address, opcode) for every instruction of a code_item's insns."""
+    address = 0
+    while address < len(insns):
+        unit = insns[address]
+        opcode = unit & 0xff
+        if unit == 0x0100:  # packed-switch-payload
+            width = insns[address + 1] * 2 + 4
+        elif unit == 0x0200:  # sparse-switch-payload
+            width = insns[address + 1] * 4 + 2
+        elif unit == 0x0300:  # fill-array-data-payload
+            element_width = insns[address + 1]
+            size = insns[address + 2] | (insns[address + 3] << 16)
+            width = (size * element_width + 1) // 2 + 4
+        else:
+            width = INSTRUCTION_WIDTHS[opcode]
+            yield address, opcode
+        address += width
+
+
+class DexFile:
+    """
+    Minimal reader and in-place writer for the parts of the dex format the
+    patcher needs: string/type/proto/method ids, class_defs, class_data and
+    code_items. See https://source.android.com/docs/core/runtime/dex-format.
+    """
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        if self.data[:4] != b'dex\n':
+            raise ValueError("Not a dex file")
+        (self.file_size, self.header_size, endian_tag, _, _, self.map_off,
+         self.string_ids_size, self.string_ids_off, self.type_ids_size, self.type_ids_off,
+         self.proto_ids_size, self.proto_ids_off, self.field_ids_size, self.field_ids_off,
+         self.method_ids_size, self.method_ids_off, self.class_defs_size, self.class_defs_off,
+         self.data_size, self.data_off) = struct.unpack_from('<20I', self.data, 32)
+        if endian_tag != 0x12345678:
+            raise ValueError("Unsupported dex endianness")
+        self._strings = {}
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, 'rb') as file:
+            return cls(file.read())
+
+    def string(self, idx):
+        if idx not in self._strings:
+            string_data_off, = struct.unpack_from('<I', self.data, self.string_ids_off + idx * 4)
+            _, start = read_uleb128(self.data, string_data_off)
+            end = self.data.index(0, start)
+            self._strings[idx] = decode_mutf8(bytes(self.data[start:end]))
+        return self._strings[idx]
+
+    def strings(self):
+        return (self.string(idx) for idx in range(self.string_ids_size))
+
+    def type_descriptor(self, idx):
+        descriptor_idx, = struct.unpack_from('<I', self.data, self.type_ids_off + idx * 4)
+        return self.string(descriptor_idx)
+
+    def type_descriptors(self):
+        return (self.type_descriptor(idx) for idx in range(self.type_ids_size))
+
+    def proto(self, idx):
+        """Return the proto as a smali signature such as (ILjava/lang/String;)Z."""
+        _, return_type_idx, parameters_off = struct.unpack_from('<3I', self.data, self.proto_ids_off + idx * 12)
+        parameters = []
+        if parameters_off:
+            size, = struct.unpack_from('<I', self.data, parameters_off)
+            type_idxs = struct.unpack_from(f'<{size}H', self.data, parameters_off + 4)
+            parameters = [self.type_descriptor(type_idx) for type_idx in type_idxs]
+        return f"({''.join(parameters)}){self.type_descriptor(return_type_idx)}"
+
+    def method(self, idx):
+        """Return (class descriptor, name, proto) of a method_id."""
+        class_idx, proto_idx, name_idx = struct.unpack_from('<HHI', self.data, self.method_ids_off + idx * 8)
+        return self.type_descriptor(class_idx), self.string(name_idx), self.proto(proto_idx)
+
+    def methods(self):
+        return (self.method(idx) for idx in range(self.method_ids_size))
+
+    def field(self, idx):
+        """Return (class descriptor, name, type descriptor) of a field_id."""
+        class_idx, type_idx, name_idx = struct.unpack_from('<HHI', self.data, self.field_ids_off + idx * 8)
+        return self.type_descriptor(class_idx), self.string(name_idx), self.type_descriptor(type_idx)
+
+    def iter_class_defs(self):
+        """Yield (class descriptor, class_data_off) for every class_def."""
+        for idx in range(self.class_defs_size):
+            class_idx, _, _, _, _, _, class_data_off, _ = struct.unpack_from(
+                '<8I', self.data, self.class_defs_off + idx * 32)
+            yield self.type_descriptor(class_idx), class_data_off
+
+    def iter_class_methods(self, class_data_off):
+        """Yield (method_idx, access_flags, code_off) for the direct and virtual methods of a class."""
+        if not class_data_off:
+            return
+        offset = class_data_off
+        counts = []
+        for _ in range(4):
+            count, offset = read_uleb128(self.data, offset)
+            counts.append(count)
+        static_fields, instance_fields, direct_methods, virtual_methods = counts
+        for _ in range((static_fields + instance_fields) * 2):
+            _, offset = read_uleb128(self.data, offset)
+        for count in (direct_methods, virtual_methods):
+            method_idx = 0
+            for _ in range(count):
+                method_idx_diff, offset = read_uleb128(self.data, offset)
+                access_flags, offset = read_uleb128(self.data, offset)
+                code_off, offset = read_uleb128(self.data, offset)
+                method_idx += method_idx_diff
+                yield method_idx, access_flags, code_off
+
+    def shared_code_offsets(self):
+        """Return the code_offs that more than one method points to, e.g. identical bodies deduplicated by d8."""
+        seen = set()
+        shared = set()
+        for _, class_data_off in self.iter_class_defs():
+            for _, _, code_off in self.iter_class_methods(class_data_off):
+                if code_off in seen:
+                    shared.add(code_off)
+                seen.add(code_off)
+        shared.discard(0)
+        return shared
+
+    def hiddenapi_flags(self, class_def_idx, class_data_off):
+        """
+        Return the hiddenapi flags of the methods of a class, in the order of
+        iter_class_methods, or None if the dex has none for it.
+        """
+        _, section_off = self.map_items().get(TYPE_HIDDENAPI_CLASS_DATA_ITEM, (0, 0))
+        if not section_off or not class_data_off:
+            return None
+        class_off, = struct.unpack_from('<I', self.data, section_off + 4 + class_def_idx * 4)
+        if not class_off:
+            return None
+        offset = class_data_off
+        counts = []
+        for _ in range(4):
+            count, offset = read_uleb128(self.data, offset)
+            counts.append(count)
+        offset = section_off + class_off
+        flags = []
+        for _ in range(sum(counts)):
+            value, offset = read_uleb128(self.data, offset)
+            flags.append(value)
+        return flags[counts[0] + counts[1]:]
+
+    def code_item(self, code_off):
+        """Return (registers_size, ins_size, outs_size, tries_size, insns_size) of a code_item."""
+        registers_size, ins_size, outs_size, tries_size, _, insns_size = struct.unpack_from(
+            '<4HII', self.data, code_off)
+        return registers_size, ins_size, outs_size, tries_size, insns_size
+
+    def insns(self, code_off):
+        insns_size, = struct.unpack_from('<I', self.data, code_off + 12)
+        return struct.unpack_from(f'<{insns_size}H', self.data, code_off + 16)
+
+    def uses_invoke_custom(self, class_data_off):
+        for _, _, code_off in self.iter_class_methods(class_data_off):
+            if code_off and any(opcode in INVOKE_CUSTOM_OPCODES
+                                for _, opcode in iter_instructions(self.insns(code_off))):
+                return True
+        return False
+
+    def map_items(self):
+        """Return {type: (size, offset)} from the map_list."""
+        size, = struct.unpack_from('<I', self.data, self.map_off)
+        items = {}
+        for idx in range(size):
+            item_type, _, item_size, item_offset = struct.unpack_from('<HHII', self.data, self.map_off + 4 + idx * 12)
+            items[item_type] = (item_size, item_offset)
+        return items
+
+    def replace_code(self, code_off, insns, registers_needed=1):
+        """
+        Overwrite a method body in place. The code_item keeps its size, tries
+        and debug info; the unused tail of the old insns is filled with nops,
+        which are never reached after the new body returns. Bodies longer
+        than the original one are rejected since growing a code_item would
+        move every item after it.
+        """
+        registers_size, _, _, _, insns_size = self.code_item(code_off)
+        if len(insns) > insns_size:
+            raise ValueError(f"New body ({len(insns)} units) does not fit code_item at {code_off:#x} "
+                             f"({insns_size} units)")
+        if registers_needed > registers_size:
+            raise ValueError(f"New body needs {registers_needed} registers, code_item at {code_off:#x} "
+                             f"has {registers_size}")
+        padded = list(insns) + [0] * (insns_size - len(insns))
+        struct.pack_into(f'<{insns_size}H', self.data, code_off + 16, *padded)
+
+    def to_bytes(self):
+        """Return the dex with its SHA-1 signature and Adler-32 checksum recomputed."""
+        self.data[12:32] = hashlib.sha1(self.data[32:]).digest()
+        struct.pack_into('<I', self.data, 8, zlib.adler32(self.data[12:]))
+        return bytes(self.data)
@@ -0,0 +1,148 @@
+import re
+import sys
+import logging
+import importlib
+
+from dex_file import HIDDENAPI_DOMAINS, HIDDENAPI_RESTRICTIONS, METHOD_ACCESS_FLAGS, DexFile
+from smali_rules import INVOKE_CUSTOM_COMPILED, MethodRule
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RULE_MODULES = {
+    'framework': 'framework_patch',
+    'services': 'services_patch',
+    'miui-services': 'miui-service_Patch',
+}
+
+RETURN_OPCODES = {'return': 0x0f, 'return-object': 0x11}
+
+
+def assemble(body):
+    """
+    Assemble a MethodRule body into dex code units. Only the handful of
+    instructions the stub rules use are supported; `.registers` and
+    annotations are skipped since the code_item keeps its register count and
+    the method keeps its annotations.
+
+    Returns (insns, registers_needed).
+    """
+    insns = []
+    registers_needed = 0
+    in_annotation = False
+    for line in body:
+        text = line.strip()
+        if in_annotation:
+            in_annotation = text != '.end annotation'
+            continue
+        if text.startswith('.annotation'):
+            in_annotation = True
+            continue
+        if not text or text.startswith('.registers'):
+            continue
+
+        if text == 'return-void':
+            insns.append(0x0e)
+            continue
+        match = re.match(r'const/4 v(\d+), (-?0x[0-9a-fA-F]+)$', text)
+        if match:
+            register, value = int(match.group(1)), int(match.group(2), 16)
+            if register > 15 or not -8 <= value <= 7:
+                raise ValueError(f"Operand out of range: {text}")
+            insns.append(((value & 0xf) << 12) | (register << 8) | 0x12)
+            registers_needed = max(registers_needed, register + 1)
+            continue
+        match = re.match(r'(return|return-object) v(\d+)$', text)
+        if match:
+            register = int(match.group(2))
+            if register > 255:
+                raise ValueError(f"Operand out of range: {text}")
+            insns.append((register << 8) | RETURN_OPCODES[match.group(1)])
+            registers_needed = max(registers_needed, register + 1)
+            continue
+        raise ValueError(f"Unsupported instruction in rule body: {text}")
+    return insns, registers_needed
+
+
+def method_declaration(name, proto, access_flags, hiddenapi_flags=None):
+    """Rebuild the `.method` line baksmali would print, for matching MethodRule patterns."""
+    flags = [flag for mask, flag in METHOD_ACCESS_FLAGS if access_flags & mask]
+    if hiddenapi_flags is not None:
+        flags.append(HIDDENAPI_RESTRICTIONS[hiddenapi_flags & 0x7])
+        flags.extend(domain for mask, domain in HIDDENAPI_DOMAINS if hiddenapi_flags & mask)
+    return f".method {' '.join(flags + [name + proto])}"
+
+
+def match_method_rule(compiled, declaration):
+    match = compiled.methods.search(declaration) if compiled and compiled.methods else None
+    return compiled.rules[match.lastgroup] if match else None
+
+
+def patch_dex(dex, compiled_rules):
+    """
+    Apply the MethodRules of compiled_rules and the invoke-custom stubs to a
+    DexFile in place. Target rules win over the invoke-custom stubs, like they
+    do on the smali path where they run last.
+
+    Returns (patched, unsupported): the patched `Lclass;->method` names and
+    the rules of classes in this dex that only the smali path can apply,
+    including stubs whose body does not fit the original code_item or whose
+    code_item other methods share.
+    """
+    patched = []
+    unsupported = []
+    shared = None
+    for class_def_idx, (descriptor, class_data_off) in enumerate(dex.iter_class_defs()):
+        compiled = compiled_rules.get(descriptor)
+        if compiled:
+            unsupported.extend((descriptor, rule.name) for rule in compiled.rules.values()
+                               if not isinstance(rule, MethodRule))
+        invoke_custom = dex.uses_invoke_custom(class_data_off)
+        if not compiled and not invoke_custom:
+            continue
+
+        hiddenapi_flags = dex.hiddenapi_flags(class_def_idx, class_data_off)
+        for position, (method_idx, access_flags, code_off) in enumerate(dex.iter_class_methods(class_data_off)):
+            _, name, proto = dex.method(method_idx)
+            declaration = method_declaration(name, proto, access_flags,
+                                             hiddenapi_flags[position] if hiddenapi_flags else None)
+            rule = match_method_rule(compiled, declaration)
+            if rule is None and invoke_custom:
+                rule = match_method_rule(INVOKE_CUSTOM_COMPILED, declaration)
+            if rule is None or not code_off:
+                continue
+            if shared is None:
+                shared = dex.shared_code_offsets()
+            if code_off in shared:
+                logging.warning(f"Cannot patch {descriptor}->{name}{proto} in place: other methods share its code")
+                unsupported.append((descriptor, rule.name))
+                continue
+            insns, registers_needed = assemble(rule.body)
+            try:
+                dex.replace_code(code_off, insns, registers_needed)
+            except ValueError as e:
+                logging.warning(f"Cannot patch {descriptor}->{name}{proto} in place: {e}")
+                unsupported.append((descriptor, rule.name))
+                continue
+            logging.debug(f"Replaced {descriptor}->{name}{proto} with {rule.name} stub")
+            patched.append(f"{descriptor}->{name}{proto}")
+    return patched, unsupported
+
+
+def main(args):
+    if len(args) not in (2, 3) or args[0] not in RULE_MODULES:
+        print(f"usage: dex_patch.py {{{'|'.join(RULE_MODULES)}}} <in.dex> [out.dex]", file=sys.stderr)
+        return 1
+    compiled_rules = importlib.import_module(RULE_MODULES[args[0]]).COMPILED_RULES
+    dex = DexFile.from_path(args[1])
+    patched, unsupported = patch_dex(dex, compiled_rules)
+    with open(args[2] if len(args) == 3 else args[1], 'wb') as file:
+        file.write(dex.to_bytes())
+    logging.info(f"Patched {len(patched)} methods in {args[1]}")
+    for descriptor, name in unsupported:
+        logging.warning(f"Rule {name} for {descriptor} needs the smali path")
+    # 2 tells the caller this dex still has to go through baksmali/smali.
+    return 2 if unsupported else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,54 @@
+import sys
+import logging
+import importlib
+
+from dex_file import TYPE_CALL_SITE_ID_ITEM, DexFile
+from dex_patch import RULE_MODULES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Selection is per dex file. Not done yet: decompiling only the patched
+# classes of a selected dex (baksmali --classes) and merging the reassembled
+# classes back into the original dex. That needs a dex merger that can add
+# and relocate code_items and fix up the index tables, and the smali
+# toolchain has none, so a selected dex is still decompiled whole.
+
+
+def find_patch_classes(dex, targets):
+    """
+    Return the descriptors of the classes in dex that the patch scripts
+    touch: the rule targets plus every class using invoke-custom. Dex files
+    without call_site_ids cannot use invoke-custom, so their code is never
+    walked.
+    """
+    call_sites, _ = dex.map_items().get(TYPE_CALL_SITE_ID_ITEM, (0, 0))
+    classes = []
+    for descriptor, class_data_off in dex.iter_class_defs():
+        if descriptor in targets or (call_sites and dex.uses_invoke_custom(class_data_off)):
+            classes.append(descriptor)
+    return classes
+
+
+def main(args):
+    """
+    Print the dex files that need to go through baksmali, one per line.
+    Dex files with nothing to patch are left out and keep their original
+    bytes.
+    """
+    if not args or args[0] not in RULE_MODULES:
+        print(f"usage: dex_targets.py {{{'|'.join(RULE_MODULES)}}} [classes.dex...]", file=sys.stderr)
+        return 1
+
+    targets = importlib.import_module(RULE_MODULES[args[0]]).COMPILED_RULES
+    for dex_path in args[1:]:
+        classes = find_patch_classes(DexFile.from_path(dex_path), targets)
+        if not classes:
+            logging.info(f"Nothing to patch in {dex_path}, skipping decompilation")
+            continue
+        logging.info(f"{len(classes)} classes to patch in {dex_path}")
+        print(dex_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
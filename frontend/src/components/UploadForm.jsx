@@ -1,4 +1,102 @@
 import React, { useState } from 'react'
+import { Sha256 } from '../sha256'
+
+const MAX_RETRIES = 5
+const HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+// Reads the file a chunk at a time, so only one chunk is in memory.
+async function sha256Hex(file, onProgress) {
+  const hash = new Sha256()
+  for (let offset = 0; offset < file.size; offset += HASH_CHUNK_SIZE) {
+    onProgress(offset / file.size)
+    hash.update(new Uint8Array(await file.slice(offset, offset + HASH_CHUNK_SIZE).arrayBuffer()))
+  }
+  return hash.hex()
+}
+
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms))
+
+// Session ids are kept per file, so a reload or a dropped connection
+// continues from the last chunk the server has instead of starting over.
+const sessionKey = file => `upload:${file.name}:${file.size}:${file.lastModified}`
+
+async function openSession(file, sha256) {
+  const saved = localStorage.getItem(sessionKey(file))
+  if (saved) {
+    const res = await fetch(`/api/uploads/${saved}`)
+    if (res.ok) {
+      return res.json()
+    }
+    localStorage.removeItem(sessionKey(file))
+  }
+  const res = await fetch('/api/uploads', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size, sha256 })
+  })
+  if (!res.ok) {
+    throw new Error('session')
+  }
+  const session = await res.json()
+  if (session.id) {
+    localStorage.setItem(sessionKey(file), session.id)
+  }
+  return session
+}
+
+async function currentOffset(session) {
+  const res = await fetch(`/api/uploads/${session.id}`)
+  if (!res.ok) {
+    throw new Error('session')
+  }
+  return Number(res.headers.get('Upload-Offset'))
+}
+
+// Sends one chunk and returns the offset the server has reached. Failed
+// requests are retried with backoff after asking the server where it is. A
+// rejected chunk (409) is not assumed to have landed: the client continues
+// from the offset the server reports, unless that would resend it as is.
+async function putChunk(session, file, offset) {
+  const end = Math.min(offset + session.chunk_size, file.size)
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const res = await fetch(`/api/uploads/${session.id}`, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+        body: file.slice(offset, end)
+      })
+      if (res.ok) {
+        return Number(res.headers.get('Upload-Offset'))
+      }
+      if (res.status === 409) {
+        const reached = await currentOffset(session)
+        if (reached === offset) {
+          throw new Error('chunk')
+        }
+        return reached
+      }
+      if (res.status < 500) {
+        throw new Error('chunk')
+      }
+    } catch (err) {
+      if (err.message === 'chunk' || attempt >= MAX_RETRIES) {
+        throw err
+      }
+    }
+    if (attempt >= MAX_RETRIES) {
+      throw new Error('chunk')
+    }
+    await sleep(1000 * 2 ** attempt)
+    try {
+      offset = await currentOffset(session)
+    } catch {
+      // The server is still unreachable; retry from the same offset.
+    }
+    if (offset >= file.size) {
+      return offset
+    }
+  }
+}
 
 function UploadForm() {
   const [file, setFile] = useState(null)
@@ -8,23 +106,37 @@ function UploadForm() {
 
   const handleSubmit = async (e) => {
     e.preventDefault()
-    setStatus("Yükleniyor...")
-    const formData = new FormData()
-    formData.append('file', file)
-    formData.append('name', name)
-    formData.append('desc', desc)
+    setStatus("Dosya doğrulanıyor...")
     try {
-      const res = await fetch('/api/upload', {
-        method: 'POST',
-        body: formData
-      })
+      const sha256 = await sha256Hex(file, done => setStatus(`Dosya doğrulanıyor... %${Math.floor(done * 100)}`))
+      const session = await openSession(file, sha256)
+      const formData = new FormData()
+      formData.append('name', name)
+      formData.append('desc', desc)
+      formData.append('sha256', sha256)
+      let res
+      if (session.duplicate) {
+        // The server already has this file; only the entry is recorded.
+        formData.append('filename', file.name)
+        res = await fetch('/api/upload', { method: 'POST', body: formData })
+      } else {
+        let offset = session.offset
+        while (offset < file.size) {
+          setStatus(`Yükleniyor... %${Math.floor(offset * 100 / file.size)}`)
+          offset = await putChunk(session, file, offset)
+        }
+        res = await fetch(`/api/uploads/${session.id}/finalize`, { method: 'POST', body: formData })
+        if (res.ok) {
+          localStorage.removeItem(sessionKey(file))
+        }
+      }
       if (res.ok) {
         setStatus("Başarıyla yüklendi!")
       } else {
         setStatus("Yükleme hatası!")
       }
     } catch {
-      setStatus("Sunucuya ulaşılamadı!")
+      setStatus("Sunucuya ulaşılamadı! Tekrar denerseniz yükleme kaldığı yerden devam eder.")
     }
   }
 
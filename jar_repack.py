@@ -0,0 +1,209 @@
+import os
+import sys
+import zlib
+import struct
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIR = struct.Struct('<IHHHHIIH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_OF_CENTRAL_DIR_SIGNATURE = 0x06054b50
+
+FLAG_DATA_DESCRIPTOR = 0x08
+STORED = 0
+ALIGNMENT = 4
+# Like `zipalign -p`: uncompressed shared libraries are aligned to a page.
+PAGE_ALIGNMENT = 4096
+COPY_CHUNK = 1 << 20
+
+
+class CentralEntry:
+    """One central directory record, kept as raw fields so it is written back unchanged."""
+
+    def __init__(self, fields, name, extra, comment):
+        self.fields = list(fields)
+        self.name = name
+        self.extra = extra
+        self.comment = comment
+
+    @property
+    def filename(self):
+        return self.name.decode('utf-8' if self.fields[3] & 0x800 else 'cp437')
+
+    @property
+    def method(self):
+        return self.fields[4]
+
+    @property
+    def crc(self):
+        return self.fields[7]
+
+    @property
+    def compressed_size(self):
+        return self.fields[8]
+
+    @property
+    def size(self):
+        return self.fields[9]
+
+    @property
+    def offset(self):
+        return self.fields[16]
+
+    def to_bytes(self):
+        return CENTRAL_HEADER.pack(*self.fields) + self.name + self.extra + self.comment
+
+
+def read_central_directory(file):
+    """Return (entries, archive comment) of the zip opened as file."""
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    tail_size = min(size, END_OF_CENTRAL_DIR.size + 0xffff)
+    file.seek(size - tail_size)
+    tail = file.read(tail_size)
+    position = tail.rfind(struct.pack('<I', END_OF_CENTRAL_DIR_SIGNATURE))
+    if position < 0:
+        raise ValueError("Not a zip file")
+    (_, disk, _, _, count, directory_size, directory_offset,
+     comment_size) = END_OF_CENTRAL_DIR.unpack_from(tail, position)
+    if disk or count == 0xffff or directory_offset == 0xffffffff:
+        raise ValueError("Multi-disk and zip64 archives are not supported")
+    comment = tail[position + END_OF_CENTRAL_DIR.size:position + END_OF_CENTRAL_DIR.size + comment_size]
+
+    file.seek(directory_offset)
+    directory = file.read(directory_size)
+    entries = []
+    offset = 0
+    for _ in range(count):
+        fields = CENTRAL_HEADER.unpack_from(directory, offset)
+        if fields[0] != CENTRAL_HEADER_SIGNATURE:
+            raise ValueError(f"Bad central directory record at {directory_offset + offset:#x}")
+        name_size, extra_size, entry_comment_size = fields[10:13]
+        offset += CENTRAL_HEADER.size
+        name = directory[offset:offset + name_size]
+        extra = directory[offset + name_size:offset + name_size + extra_size]
+        entry_comment = directory[offset + name_size + extra_size:
+                                  offset + name_size + extra_size + entry_comment_size]
+        offset += name_size + extra_size + entry_comment_size
+        entries.append(CentralEntry(fields, name, extra, entry_comment))
+    return entries, comment
+
+
+def entry_alignment(entry):
+    if entry.method != STORED:
+        return 1
+    return PAGE_ALIGNMENT if entry.filename.endswith('.so') else ALIGNMENT
+
+
+def write_local_header(out, source_header, entry, crc, compressed_size, size):
+    """
+    Write the local header of entry at the current position of out, padding
+    its extra field so the data of stored entries starts aligned. Sizes and
+    CRC always go in the header, so no data descriptor follows the data.
+    """
+    fields = list(LOCAL_HEADER.unpack_from(source_header))
+    name_end = LOCAL_HEADER.size + fields[9]
+    name, extra = source_header[LOCAL_HEADER.size:name_end], source_header[name_end:]
+    alignment = entry_alignment(entry)
+    data_offset = out.tell() + LOCAL_HEADER.size + len(name) + len(extra)
+    extra += b'\0' * (-data_offset % alignment)
+    fields[2] &= ~FLAG_DATA_DESCRIPTOR
+    fields[6:11] = [crc, compressed_size, size, len(name), len(extra)]
+    out.write(LOCAL_HEADER.pack(*fields) + name + extra)
+
+
+def read_local_header(file, entry):
+    """Return the raw local header of entry and leave file at the start of its data."""
+    file.seek(entry.offset)
+    fixed = file.read(LOCAL_HEADER.size)
+    fields = LOCAL_HEADER.unpack(fixed)
+    if fields[0] != LOCAL_HEADER_SIGNATURE:
+        raise ValueError(f"Bad local header for {entry.filename}")
+    return fixed + file.read(fields[9] + fields[10])
+
+
+def copy_data(source, out, size):
+    while size:
+        chunk = source.read(min(size, COPY_CHUNK))
+        if not chunk:
+            raise ValueError("Unexpected end of zip data")
+        out.write(chunk)
+        size -= len(chunk)
+
+
+def encode_entry(data, method):
+    if method == STORED:
+        return data
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def repack(jar_path, replacements, out_path):
+    """
+    Write jar_path to out_path with the entries named in replacements
+    ({entry name: file path}) swapped for the given files. Every other entry
+    is copied as raw compressed bytes, and stored entries are aligned the
+    way `zipalign -p 4` does, so the result needs no separate align pass.
+    Replacements whose bytes match the original entry are copied raw too.
+
+    Returns the names of the entries that were replaced.
+    """
+    replaced = []
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(jar_path, 'rb') as source, open(tmp_path, 'wb') as out:
+        entries, comment = read_central_directory(source)
+        unknown = set(replacements) - {entry.filename for entry in entries}
+        if unknown:
+            raise ValueError(f"Entries not found in {jar_path}: {', '.join(sorted(unknown))}")
+
+        for entry in entries:
+            source_header = read_local_header(source, entry)
+            data = None
+            replacement = replacements.get(entry.filename)
+            if replacement:
+                with open(replacement, 'rb') as file:
+                    data = file.read()
+                crc = zlib.crc32(data)
+                if crc == entry.crc and len(data) == entry.size:
+                    data = None
+            offset = out.tell()
+            if data is None:
+                write_local_header(out, source_header, entry, entry.crc, entry.compressed_size, entry.size)
+                copy_data(source, out, entry.compressed_size)
+            else:
+                encoded = encode_entry(data, entry.method)
+                write_local_header(out, source_header, entry, crc, len(encoded), len(data))
+                out.write(encoded)
+                entry.fields[7:10] = [crc, len(encoded), len(data)]
+                replaced.append(entry.filename)
+            entry.fields[3] &= ~FLAG_DATA_DESCRIPTOR
+            entry.fields[16] = offset
+            if offset > 0xffffffff:
+                raise ValueError(f"{out_path} would need zip64")
+
+        directory_offset = out.tell()
+        for entry in entries:
+            out.write(entry.to_bytes())
+        directory_size = out.tell() - directory_offset
+        out.write(END_OF_CENTRAL_DIR.pack(END_OF_CENTRAL_DIR_SIGNATURE, 0, 0, len(entries), len(entries),
+                                          directory_size, directory_offset, len(comment)) + comment)
+    os.replace(tmp_path, out_path)
+    return replaced
+
+
+def main(args):
+    if len(args) < 2 or any('=' not in arg for arg in args[2:]):
+        print("usage: jar_repack.py <in.jar> <out.jar> [entry=file...]", file=sys.stderr)
+        return 1
+    replacements = dict(arg.split('=', 1) for arg in args[2:])
+    replaced = repack(args[0], replacements, args[1])
+    logging.info(f"Wrote {args[1]}, replaced {len(replaced)} entries: {', '.join(replaced)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
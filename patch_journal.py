@@ -0,0 +1,98 @@
+import os
+import sys
+import shutil
+import difflib
+import logging
+
+# Original bytes of every file the patch scripts rewrite, stored under the
+# same relative path. Replaces copying whole decompiled trees to *_backup.
+JOURNAL_DIR = '.patch_journal'
+
+
+def journal_path(file_path):
+    return os.path.join(JOURNAL_DIR, os.path.relpath(file_path))
+
+
+def snapshot(file_path):
+    """
+    Record the original bytes of file_path before its first rewrite. Later
+    rewrites keep the first snapshot. The snapshot is a hardlink when
+    possible, which stays valid because files are rewritten by renaming a
+    new file over them.
+    """
+    saved = journal_path(file_path)
+    if os.path.exists(saved):
+        return
+    os.makedirs(os.path.dirname(saved), exist_ok=True)
+    try:
+        os.link(file_path, saved)
+    except OSError:
+        shutil.copy2(file_path, saved)
+
+
+def iter_journal(paths=None):
+    """Yield (file path, snapshot path) for every journaled file, or only for paths."""
+    if paths:
+        for file_path in paths:
+            saved = journal_path(file_path)
+            if not os.path.exists(saved):
+                logging.warning(f"No journal entry for {file_path}")
+                continue
+            yield os.path.relpath(file_path), saved
+        return
+    for root, dirs, files in os.walk(JOURNAL_DIR):
+        dirs.sort()
+        for file in sorted(files):
+            saved = os.path.join(root, file)
+            yield os.path.relpath(saved, JOURNAL_DIR), saved
+
+
+def restore(paths=None):
+    """Put the original bytes back and drop their journal entries."""
+    restored = 0
+    for file_path, saved in iter_journal(paths):
+        os.replace(saved, file_path)
+        logging.info(f"Restored {file_path}")
+        restored += 1
+    return restored
+
+
+def diff(paths=None, out=sys.stdout):
+    """Write a unified diff of every journaled file against its current content."""
+    for file_path, saved in iter_journal(paths):
+        with open(saved) as file:
+            original = file.readlines()
+        try:
+            with open(file_path) as file:
+                current = file.readlines()
+        except FileNotFoundError:
+            current = []
+        out.writelines(difflib.unified_diff(original, current, f"a/{file_path}", f"b/{file_path}"))
+
+
+def clear(directories, root='.'):
+    """
+    Forget the snapshots of directories, e.g. before decompiling into them
+    again. root is the directory the patch scripts run in.
+    """
+    for directory in directories:
+        shutil.rmtree(os.path.join(root, journal_path(directory)), ignore_errors=True)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args and args[0] == 'restore':
+        logging.info(f"Restored {restore(args[1:])} files")
+        return 0
+    if args and args[0] == 'diff':
+        diff(args[1:])
+        return 0
+    if args and args[0] == 'clear':
+        clear(args[1:])
+        return 0
+    print("usage: patch_journal.py restore [file...] | diff [file...] | clear <directory>...", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
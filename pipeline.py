@@ -0,0 +1,267 @@
+import os
+import sys
+import time
+import logging
+import zipfile
+import argparse
+import importlib
+import threading
+import subprocess
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import dex_cache
+import jar_repack
+import patch_journal
+from dex_file import DexFile
+from dex_patch import RULE_MODULES, patch_dex
+from dex_targets import find_patch_classes
+from smali_utils import read_patched_list
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# jar: input jar, extract_dir: where its dex files are unpacked, class_prefix:
+# smali directory of classes.dex (classes2.dex goes to <prefix>2, ...),
+# script: patch script, install_path: where the repacked jar is written.
+JarSpec = namedtuple('JarSpec', ['name', 'jar', 'extract_dir', 'class_prefix', 'script', 'install_path'])
+
+JARS = [
+    JarSpec('framework', 'framework.jar', 'framework', 'classes', 'framework_patch.py',
+            'system/system/framework/framework.jar'),
+    JarSpec('services', 'services.jar', 'services', 'services_classes', 'services_patch.py',
+            'system/system/framework/services.jar'),
+    JarSpec('miui-services', 'miui-services.jar', 'miui_services', 'miui_services_classes', 'miui-service_Patch.py',
+            'system_ext/framework/miui-services.jar'),
+]
+
+
+class JobGraph:
+    """
+    Runs named jobs on a bounded thread pool as soon as all of their
+    dependencies have finished. Jobs may add more jobs while they run, which
+    is how the per-dex stages are added once a jar has been inspected.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.jobs = {}
+        self.finished = set()
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        with self.lock:
+            self.jobs[name] = (func, tuple(deps))
+
+    def timed(self, name, func):
+        start = time.monotonic()
+        try:
+            return func()
+        finally:
+            self.timings[name] = (start, time.monotonic())
+
+    def run(self):
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                with self.lock:
+                    ready = [name for name, (_, deps) in self.jobs.items()
+                             if name not in self.finished and name not in running.values()
+                             and all(dep in self.finished for dep in deps)]
+                for name in ready:
+                    logging.info(f"Starting {name}")
+                    running[executor.submit(self.timed, name, self.jobs[name][0])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()  # re-raises the failure of a job and stops the run
+                    self.finished.add(name)
+
+        unfinished = set(self.jobs) - self.finished
+        if unfinished:
+            raise RuntimeError(f"Jobs with unmet dependencies: {', '.join(sorted(unfinished))}")
+
+    def report(self):
+        if not self.timings:
+            return
+        origin = min(start for start, _ in self.timings.values())
+        stages = {}
+        print("\nJob timings:")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            print(f"  {name:<48} {start - origin:8.1f}s {end - start:8.1f}s")
+            stage = name.split(':')[0]
+            stages[stage] = stages.get(stage, 0) + end - start
+        print("Stage totals:")
+        for stage, total in stages.items():
+            print(f"  {stage:<48} {total:8.1f}s")
+        print(f"Wall time: {max(end for _, end in self.timings.values()) - origin:.1f}s")
+
+
+def run_command(args, cwd=None):
+    result = subprocess.run(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed with exit code {result.returncode}:\n{result.stdout}")
+    return result.stdout
+
+
+def class_dir(spec, dex_name):
+    return spec.class_prefix + dex_name[len('classes'):-len('.dex')]
+
+
+# One jar to build: its spec, the directory its files live in (the spec's
+# paths are relative to it), the API level and the name its jobs use.
+Target = namedtuple('Target', ['spec', 'workdir', 'api', 'tag'])
+
+
+def target_path(target, path):
+    return os.path.normpath(os.path.join(target.workdir, path))
+
+
+class Build:
+    def __init__(self, options):
+        self.options = options
+        self.graph = JobGraph(options.jobs)
+        self.jar_count = 0
+        self.cache_settings = dex_cache.build_settings([options.smali, options.baksmali], not options.no_dex_patch)
+
+    def java(self, tool, *args):
+        return run_command(['java', '-jar', tool] + list(args))
+
+    def add_jar(self, spec, workdir='.', api=None, tag=None):
+        """Add the jobs of one jar and return the name of its last job."""
+        target = Target(spec, workdir, api or self.options.api, tag or spec.name)
+        self.jar_count += 1
+        extract = f"extract:{target.tag}"
+        self.graph.add(extract, lambda: self.extract(target))
+        self.graph.add(f"plan:{target.tag}", lambda: self.plan(target), [extract])
+        return f"repack:{target.tag}"
+
+    def extract(self, target):
+        """Unpack only the dex files; everything else is copied from the jar as is when repacking."""
+        with zipfile.ZipFile(target_path(target, target.spec.jar)) as jar:
+            for name in jar.namelist():
+                if name.startswith('classes') and name.endswith('.dex'):
+                    jar.extract(name, target_path(target, target.spec.extract_dir))
+
+    def patch_in_place(self, dex_path, dex, targets):
+        """
+        Stub the methods of dex straight in the file when every rule that
+        touches it is a MethodRule whose body fits (see dex_patch). Returns
+        False, leaving the file as it is, when it needs the baksmali path.
+        """
+        if self.options.no_dex_patch:
+            return False
+        patched, unsupported = patch_dex(dex, targets)
+        if unsupported:
+            logging.info(f"{dex_path} needs baksmali for {', '.join(sorted({name for _, name in unsupported}))}")
+            return False
+        with open(dex_path, 'wb') as file:
+            file.write(dex.to_bytes())
+        logging.info(f"Patched {len(patched)} methods in place in {dex_path}")
+        return True
+
+    def plan(self, target):
+        """
+        Restore cached dex files, patch the ones that only need method stubs
+        in place, pick the rest to decompile and add the jar's other jobs.
+        """
+        spec = target.spec
+        extract_dir = target_path(target, spec.extract_dir)
+        dex_names = sorted(name for name in os.listdir(extract_dir)
+                           if name.startswith('classes') and name.endswith('.dex'))
+        pending = dex_cache.restore([os.path.join(extract_dir, name) for name in dex_names], target.api,
+                                    self.cache_settings)
+        targets = importlib.import_module(RULE_MODULES[spec.name]).COMPILED_RULES
+        selected = []
+        for name in dex_names:
+            dex_path = os.path.join(extract_dir, name)
+            if dex_path not in pending:
+                continue
+            dex = DexFile.from_path(dex_path)
+            if find_patch_classes(dex, targets) and not self.patch_in_place(dex_path, dex, targets):
+                selected.append(name)
+
+        patch = f"patch:{target.tag}"
+        decompiles = []
+        recompiles = []
+        for name in selected:
+            dex_path = os.path.join(extract_dir, name)
+            directory = class_dir(spec, name)
+            decompile = f"decompile:{target.tag}/{name}"
+            self.graph.add(decompile, lambda d=dex_path, o=directory: self.decompile(target, d, o))
+            recompile = f"recompile:{target.tag}/{name}"
+            self.graph.add(recompile, lambda d=dex_path, o=directory: self.recompile(target, d, o), [patch])
+            decompiles.append(decompile)
+            recompiles.append(recompile)
+
+        self.graph.add(patch, lambda: run_command(
+            [sys.executable, os.path.join(SCRIPT_DIR, spec.script), str(self.script_workers())], cwd=target.workdir),
+            decompiles)
+        store = f"cache:{target.tag}"
+        self.graph.add(store, lambda: dex_cache.store(pending), recompiles)
+        self.graph.add(f"repack:{target.tag}", lambda: self.repack(target, dex_names), [store])
+
+    def script_workers(self):
+        """
+        Process pool size for one patch script. The patch jobs of every jar
+        can run at once, so the job budget is split between them instead of
+        each script starting a pool of the full size.
+        """
+        return max(1, self.options.jobs // self.jar_count)
+
+    def decompile(self, target, dex_path, directory):
+        # The patch scripts journal the original of every file they change,
+        # so snapshots from an earlier run of this directory are stale.
+        patch_journal.clear([directory], root=target.workdir)
+        self.java(self.options.baksmali, 'd', '-a', target.api, dex_path, '-o', target_path(target, directory))
+
+    def recompile(self, target, dex_path, directory):
+        directory = target_path(target, directory)
+        if read_patched_list(directory) == []:
+            logging.info(f"Nothing changed in {directory}, keeping the original {dex_path}")
+            return
+        self.java(self.options.smali, 'a', '-a', target.api, directory, '-o', dex_path)
+
+    def repack(self, target, dex_names):
+        """Write the jar straight to its install path with the rebuilt dex files swapped in, aligned."""
+        spec = target.spec
+        install_path = target_path(target, spec.install_path)
+        extract_dir = target_path(target, spec.extract_dir)
+        os.makedirs(os.path.dirname(install_path), exist_ok=True)
+        replaced = jar_repack.repack(target_path(target, spec.jar),
+                                     {name: os.path.join(extract_dir, name) for name in dex_names}, install_path)
+        logging.info(f"Wrote {install_path}, replaced {', '.join(replaced) or 'no entries'}")
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Patch framework.jar, services.jar and miui-services.jar.")
+    parser.add_argument('--api', default='35', help="Android API level passed to baksmali/smali")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="number of concurrent jobs")
+    parser.add_argument('--baksmali', default='baksmali.jar')
+    parser.add_argument('--smali', default='smali.jar')
+    parser.add_argument('--no-dex-patch', action='store_true',
+                        help="always decompile with baksmali instead of stubbing methods in the dex first")
+    parser.add_argument('jars', nargs='*', help="jars to patch: " + ", ".join(spec.name for spec in JARS)
+                        + " (default: all)")
+    options = parser.parse_args(args)
+    unknown = set(options.jars) - {spec.name for spec in JARS}
+    if unknown:
+        parser.error(f"unknown jar: {', '.join(sorted(unknown))}")
+
+    build = Build(options)
+    for spec in JARS:
+        if not options.jars or spec.name in options.jars:
+            build.add_jar(spec)
+    try:
+        build.graph.run()
+    finally:
+        build.graph.report()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,181 @@
+import os
+import re
+import sys
+import time
+import logging
+import zipfile
+import argparse
+import importlib
+
+from dex_file import DexFile, iter_instructions
+from dex_patch import RULE_MODULES, method_declaration
+from pipeline import JARS
+from smali_rules import AnchorRule, InsertRule
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+OK = 'ok'
+MISSING = 'MISSING'
+UNCHECKED = '?'  # the anchor is plain code, which the dex tables cannot show
+NOT_APPLICABLE = '-'
+
+METHOD_REF = re.compile(r'(\[*L[^;\s]+;)->([^\s(:]+)(\([^)\s]*\)\S+)')
+FIELD_REF = re.compile(r'(L[^;\s]+;)->([^\s(:]+):(\S+)')
+STRING_LITERAL = re.compile(r'"((?:[^"\\]|\\.)*)"')
+INSTRUCTION = re.compile(r'[a-z][a-z0-9/-]*\s')
+
+STRING_OPCODES = (0x1a, 0x1b)  # const-string, const-string/jumbo
+FIELD_OPCODES = range(0x52, 0x6e)  # iget* through sput*
+METHOD_OPCODES = set(range(0x6e, 0x73)) | set(range(0x74, 0x79)) | {0xfa, 0xfb}  # invoke-*
+
+
+def unescape(text):
+    return re.sub(r'\\(.)', lambda match: {'n': '\n', 't': '\t', 'r': '\r'}.get(match.group(1), match.group(1)), text)
+
+
+def anchor_references(anchor):
+    """
+    Return what the dex has to contain for anchor to be found after
+    baksmali: the methods, fields and strings it references, as
+    ('method'|'field'|'string', text) pairs, or ('text', anchor) for a piece
+    of a string constant. Returns None for plain code such as
+    `const/4 v1, 0x0`, which the dex tables cannot show.
+    """
+    references = {('method', f"{match.group(1)}->{match.group(2)}{match.group(3)}")
+                  for match in METHOD_REF.finditer(anchor)}
+    references |= {('field', f"{match.group(1)}->{match.group(2)}:{match.group(3)}")
+                   for match in FIELD_REF.finditer(anchor)}
+    references |= {('string', unescape(match.group(1))) for match in STRING_LITERAL.finditer(anchor)}
+    if references:
+        return references
+    if INSTRUCTION.match(anchor):
+        return None
+    return {('text', anchor)}
+
+
+def code_references(dex, code_off):
+    """Return the strings, fields and methods the code_item at code_off references, like anchor_references."""
+    insns = dex.insns(code_off)
+    references = set()
+    for address, opcode in iter_instructions(insns):
+        if opcode in STRING_OPCODES:
+            idx = insns[address + 1] | (insns[address + 2] << 16 if opcode == 0x1b else 0)
+            references.add(('string', dex.string(idx)))
+        elif opcode in FIELD_OPCODES:
+            class_descriptor, name, type_descriptor = dex.field(insns[address + 1])
+            references.add(('field', f"{class_descriptor}->{name}:{type_descriptor}"))
+        elif opcode in METHOD_OPCODES:
+            class_descriptor, name, proto = dex.method(insns[address + 1])
+            references.add(('method', f"{class_descriptor}->{name}{proto}"))
+    return references
+
+
+def index_classes(jar_path, targets):
+    """
+    Read the dex files of jar_path straight from the jar and return
+    {descriptor: [(`.method` line, references)]} for the target classes.
+    """
+    classes = {}
+    with zipfile.ZipFile(jar_path) as jar:
+        for name in jar.namelist():
+            if not (name.startswith('classes') and name.endswith('.dex')):
+                continue
+            dex = DexFile(jar.read(name))
+            for class_def_idx, (descriptor, class_data_off) in enumerate(dex.iter_class_defs()):
+                if descriptor not in targets:
+                    continue
+                methods = classes.setdefault(descriptor, [])
+                hiddenapi_flags = dex.hiddenapi_flags(class_def_idx, class_data_off)
+                for position, (method_idx, access_flags, code_off) in enumerate(
+                        dex.iter_class_methods(class_data_off)):
+                    _, method_name, proto = dex.method(method_idx)
+                    declaration = method_declaration(method_name, proto, access_flags,
+                                                     hiddenapi_flags[position] if hiddenapi_flags else None)
+                    methods.append((declaration, code_references(dex, code_off) if code_off else set()))
+    return classes
+
+
+def check_anchor(anchor, methods):
+    expected = anchor_references(anchor)
+    if expected is None:
+        return UNCHECKED
+    found = set().union(*(references for _, references in methods))
+    strings = [text for kind, text in found if kind == 'string']
+    for kind, text in expected:
+        present = any(text in string for string in strings) if kind == 'text' else (kind, text) in found
+        if not present:
+            return MISSING
+    return OK
+
+
+def check_rule(rule, methods):
+    """Return the (method, anchor) status of rule in a class with these methods."""
+    method_pattern = getattr(rule, 'method', None)
+    if method_pattern is not None:
+        methods = [method for method in methods if re.search(method_pattern, method[0])]
+    method_status = NOT_APPLICABLE if method_pattern is None else OK if methods else MISSING
+    if not isinstance(rule, (InsertRule, AnchorRule)):
+        return method_status, NOT_APPLICABLE
+    if method_status == MISSING:
+        return method_status, UNCHECKED
+    return method_status, check_anchor(rule.anchor, methods)
+
+
+def check_jar(spec, workdir):
+    """
+    Print the matrix of spec's rules and return (failed, skipped): the names
+    of the rules that cannot apply anywhere, required and optional ones.
+    """
+    rules = importlib.import_module(RULE_MODULES[spec.name]).RULES
+    jar_path = os.path.join(workdir, spec.jar)
+    start = time.monotonic()
+    classes = index_classes(jar_path, {target for rule in rules for target in rule.targets})
+    print(f"\n{jar_path} ({time.monotonic() - start:.1f}s)")
+    print(f"  {'rule':<46} {'target':<64} {'class':<8} {'method':<8} {'anchor':<8}")
+    failed = []
+    skipped = []
+    for rule in rules:
+        applies = False
+        for target in rule.targets:
+            if target in classes:
+                statuses = (OK,) + check_rule(rule, classes[target])
+            else:
+                statuses = (MISSING, UNCHECKED, UNCHECKED)
+            applies = applies or MISSING not in statuses
+            print(f"  {rule.name:<46} {target:<64} " + ' '.join(f"{status:<8}" for status in statuses))
+        if not applies:
+            (skipped if getattr(rule, 'optional', False) else failed).append(rule.name)
+    return failed, skipped
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Check that the patch rules still find their classes, methods and anchors in the input jars, "
+                    "without decompiling them.")
+    parser.add_argument('--workdir', default='.', help="directory the jars are in")
+    parser.add_argument('jars', nargs='*', help="jars to check: " + ", ".join(spec.name for spec in JARS)
+                        + " (default: all)")
+    options = parser.parse_args(args)
+    unknown = set(options.jars) - {spec.name for spec in JARS}
+    if unknown:
+        parser.error(f"unknown jar: {', '.join(sorted(unknown))}")
+
+    failed = []
+    skipped = []
+    for spec in JARS:
+        if not options.jars or spec.name in options.jars:
+            jar_failed, jar_skipped = check_jar(spec, options.workdir)
+            failed.extend(f"{spec.name}: {name}" for name in jar_failed)
+            skipped.extend(f"{spec.name}: {name}" for name in jar_skipped)
+    print(f"\n{UNCHECKED}: plain code anchors are only found after decompiling")
+    if skipped:
+        logging.warning(f"Optional rules that match none of their targets: {', '.join(skipped)}")
+    if failed:
+        logging.error(f"Rules that match none of their targets: {', '.join(failed)}")
+        return 1
+    logging.info("Every rule matches at least one of its targets")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Counters, per-rule matches and time, and per-phase wall time of a patch
+    run. Kept as plain dicts so a pool worker can send its share back to be
+    merged.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.rules = {}
+        self.phases = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def rule(self, name, matches=0, seconds=0.0):
+        entry = self.rules.setdefault(name, {'matches': 0, 'seconds': 0.0})
+        entry['matches'] += matches
+        entry['seconds'] += seconds
+
+    @contextmanager
+    def timed_rule(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.rule(name, seconds=time.perf_counter() - start)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def to_dict(self):
+        return {'counters': self.counters, 'rules': self.rules, 'phases': self.phases}
+
+    def merge(self, data):
+        for name, amount in data['counters'].items():
+            self.count(name, amount)
+        for name, entry in data['rules'].items():
+            self.rule(name, entry['matches'], entry['seconds'])
+        for name, seconds in data['phases'].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def summary(self):
+        lines = ["Counters: " + ", ".join(f"{name}={value}" for name, value in sorted(self.counters.items()))]
+        for name, entry in sorted(self.rules.items(), key=lambda item: (-item[1]['seconds'], item[0])):
+            timing = f", {entry['seconds'] * 1000:.1f} ms" if entry['seconds'] else ""
+            lines.append(f"Rule {name}: {entry['matches']} matches{timing}")
+        lines.append("Phases: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.phases.items()))
+        return lines
+
+    def report(self, path):
+        """Log the summary and write the JSON report to path."""
+        for line in self.summary():
+            logging.info(line)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(tmp_file, path)
+        logging.info(f"Metrics written to {path}")
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def collect():
+    """Count into a fresh Metrics for the duration of the block, e.g. one patch run or one batch in a pool worker."""
+    global METRICS
+    previous, METRICS = METRICS, Metrics()
+    try:
+        yield METRICS
+    finally:
+        METRICS = previous
+
+
+def metrics():
+    return METRICS
+
+
+def report_path(name):
+    return os.path.join(os.environ.get('PATCHER_METRICS_DIR', '.'), f"{name}_metrics.json")
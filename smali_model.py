@@ -0,0 +1,166 @@
+import io
+import re
+import logging
+from bisect import bisect_right
+from collections import namedtuple
+
+from smali_metrics import metrics
+
+# A method of a SmaliFile: the `.method` line without its newline, the name
+# and descriptor (e.g. `parseSharedUser(...)...`), and byte offsets into the
+# buffer: start of the `.method` line, start and end of the body, and the end
+# of the `.end method` line.
+Method = namedtuple('Method', ['header', 'signature', 'start', 'body_start', 'body_end', 'end'])
+
+# Starting with a literal lets the regex engine skip ahead to each '.', which
+# is much faster than anchoring at line starts; hits that are not a line of
+# their own are skipped afterwards.
+METHOD_BOUNDARY = re.compile(rb'\.(method [^\n]*|end method)')
+
+
+def normalize_newlines(data):
+    """Turn CRLF and CR newlines into LF, the same newline handling as readlines() in text mode."""
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data
+
+
+class SmaliFile:
+    """
+    A smali file kept as one bytes buffer instead of a list of line strings.
+    Lines are only decoded when a rule asks for them, and the methods are
+    indexed by signature in one scan of the buffer the first time they are
+    needed. Rules change the file by splicing byte ranges, e.g. a method
+    body; the method index is shifted rather than rebuilt.
+    """
+
+    def __init__(self, data):
+        self.data = normalize_newlines(data)
+        self.changed = False
+        self._methods = None
+        self._by_signature = None
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        metrics().count('bytes_read', len(data))
+        return cls(data)
+
+    def line_start(self, position):
+        """Return the offset of the start of the line that contains byte position."""
+        return self.data.rfind(b'\n', 0, position) + 1
+
+    def lines(self):
+        """Decode the whole file into strings, like readlines() would."""
+        return self.text_lines(0, len(self.data))
+
+    def text_lines(self, begin, finish):
+        return io.StringIO(self.data[begin:finish].decode(), newline='\n').readlines()
+
+    def scan_methods(self, begin=0, finish=None):
+        """
+        Find the methods in the bytes [begin, finish), whole lines. Returns
+        (methods, complete); complete is False if the range ends inside a
+        method.
+        """
+        data = self.data
+        methods = []
+        header = None
+        for match in METHOD_BOUNDARY.finditer(data, begin, len(data) if finish is None else finish):
+            start = self.line_start(match.start())
+            end = data.find(b'\n', match.end()) + 1 or len(data)
+            if data[start:match.start()].strip(b' \t'):
+                continue
+            if match.group(1) != b'end method':
+                header = (match.group(0).rstrip(b' \t').decode(), start, end)
+            elif header and not data[match.end():end].strip():
+                text, header_start, body_start = header
+                methods.append(Method(text, text.split()[-1], header_start, body_start, start, end))
+                header = None
+        return methods, header is None
+
+    @property
+    def methods(self):
+        """Every method in file order, found in a single scan of the buffer."""
+        if self._methods is None:
+            self._methods = self.scan_methods()[0]
+            self._by_signature = None
+        return self._methods
+
+    def method_at(self, position):
+        """Return the method that contains byte position, or None."""
+        methods = self.methods
+        index = bisect_right([method.start for method in methods], position) - 1
+        if index >= 0 and position < methods[index].end:
+            return methods[index]
+        return None
+
+    def method(self, signature):
+        """Return the first method with this signature, or with this name if no descriptor is given."""
+        methods = self.methods
+        if self._by_signature is None:
+            by_signature = {}
+            for method in reversed(methods):
+                by_signature[method.signature] = method
+                by_signature[method.signature.split('(', 1)[0]] = method
+            self._by_signature = by_signature
+        return self._by_signature.get(signature)
+
+    def find_methods(self, pattern):
+        """Return the methods whose `.method` line matches pattern (a compiled regex)."""
+        return [method for method in self.methods if pattern.search(method.header)]
+
+    def method_lines(self, method):
+        """The lines of method, `.method` through `.end method`."""
+        return self.text_lines(method.start, method.end)
+
+    def body_lines(self, method):
+        return self.text_lines(method.body_start, method.body_end)
+
+    def splice(self, begin, finish, new_lines):
+        """Replace the bytes [begin, finish), whole lines, with new_lines."""
+        new_data = ''.join(new_lines).encode()
+        if self.data[begin:finish] == new_data:
+            return
+        self.data = self.data[:begin] + new_data + self.data[finish:]
+        self.changed = True
+
+        delta = len(new_data) - (finish - begin)
+        if self._methods is not None:
+            methods = []
+            for method in self._methods:
+                if method.end <= begin:
+                    methods.append(method)
+                elif method.start >= finish:
+                    methods.append(method._replace(start=method.start + delta, body_start=method.body_start + delta,
+                                                   body_end=method.body_end + delta, end=method.end + delta))
+                elif method.body_start <= begin and finish <= method.body_end:
+                    methods.append(method._replace(body_end=method.body_end + delta, end=method.end + delta))
+                elif method.start == begin and method.end == finish:
+                    # The whole method was replaced: index only what replaced it.
+                    replaced, complete = self.scan_methods(begin, begin + len(new_data))
+                    if not complete:
+                        logging.debug(f"Replacement of {method.signature} leaves a method open, reindexing methods")
+                        methods = None
+                        break
+                    methods.extend(replaced)
+                else:  # the splice touched the method's own boundaries, scan again
+                    logging.debug(f"Splice over {method.signature} boundaries, reindexing methods")
+                    methods = None
+                    break
+            self._methods = methods
+            self._by_signature = None
+
+    def insert_lines(self, position, new_lines):
+        """Insert new_lines above the line that contains byte position."""
+        start = self.line_start(position)
+        self.splice(start, start, new_lines)
+
+    def replace_method_body(self, method, body):
+        """Replace everything between the `.method` and `.end method` lines of method with body."""
+        self.splice(method.body_start, method.body_end, body)
+
+    def replace_method(self, method, method_lines):
+        """Replace the whole method, `.method` through `.end method`, with method_lines."""
+        self.splice(method.start, method.end, method_lines)
@@ -0,0 +1,280 @@
+import os
+import re
+import logging
+from collections import namedtuple
+
+from smali_metrics import metrics
+from smali_model import SmaliFile, normalize_newlines
+from smali_utils import INVOKE_CUSTOM, replace_file, write_bytes
+
+# Target classes larger than this are rewritten one method at a time.
+STREAM_THRESHOLD = int(os.environ.get('PATCHER_STREAM_THRESHOLD', 1 << 20))
+
+# Replace the body of every method whose `.method` line matches `method`.
+# With keep_registers the original `.registers` line is kept in front of body,
+# otherwise body has to bring its own. Optional rules are kept for builds that
+# still have the method; preflight only warns when they match nothing.
+MethodRule = namedtuple('MethodRule', ['targets', 'name', 'method', 'body', 'keep_registers', 'optional'],
+                        defaults=(False,))
+
+# Insert `line` above every line that contains the literal text `anchor`.
+InsertRule = namedtuple('InsertRule', ['targets', 'name', 'anchor', 'line'])
+
+# Run func at every line that contains the literal text `anchor`, inside a
+# method whose `.method` line matches `method` (any method if None). func
+# gets the lines of the method, `.method` through `.end method`, and the
+# index of the anchor line in them, and returns the method's new lines.
+AnchorRule = namedtuple('AnchorRule', ['targets', 'name', 'anchor', 'method', 'func'])
+
+# methods: MethodRule patterns, matched against `.method` lines; anchors: the
+# literal anchors of the InsertRules and AnchorRules, whose one scan of the
+# file finds the lines that hold any of them, and anchor_rules: {anchor
+# bytes: rules}.
+CompiledTarget = namedtuple('CompiledTarget', ['methods', 'anchors', 'anchor_rules', 'rules'])
+
+RETURN_TRUE = ["    const/4 v0, 0x1\n", "    return v0\n"]
+RETURN_FALSE = ["    const/4 v0, 0x0\n", "    return v0\n"]
+
+INVOKE_CUSTOM_RULES = [
+    MethodRule(None, "equals", r'\.method.*equals\(Ljava/lang/Object;\)Z', RETURN_FALSE, True),
+    MethodRule(None, "hashCode", r'\.method.*hashCode\(\)I', RETURN_FALSE, True),
+    MethodRule(None, "toString", r'\.method.*toString\(\)Ljava/lang/String;',
+               ["     const/4 v0, 0x0\n", "    return-object v0\n"], True),
+]
+
+
+def compile_target(rules):
+    """
+    Compile the rules of one target: the MethodRules into one named-group
+    alternation matched once per method header, and the literal anchors into
+    one alternation that finds the lines with any anchor in a single scan.
+    """
+    group_rules = {}
+    methods = []
+    anchor_rules = {}
+    for rule in rules:
+        group = f"r{len(group_rules)}"
+        group_rules[group] = rule
+        if isinstance(rule, MethodRule):
+            methods.append(f"(?P<{group}>{rule.method})")
+        else:
+            anchor_rules.setdefault(rule.anchor.encode(), []).append(rule)
+    # No groups here: they keep the regex engine from skipping ahead to the
+    # next candidate. The scan only finds candidate lines; find_anchors then
+    # looks for every anchor in them.
+    anchors = b'|'.join(re.escape(anchor) for anchor in anchor_rules)
+    return CompiledTarget(re.compile('|'.join(methods)) if methods else None,
+                          re.compile(anchors) if anchors else None,
+                          anchor_rules, group_rules)
+
+
+def compile_rules(rules):
+    """Group rules by target class descriptor and compile each group once."""
+    by_target = {}
+    for rule in rules:
+        for target in rule.targets:
+            by_target.setdefault(target, []).append(rule)
+    return {target: compile_target(target_rules) for target, target_rules in by_target.items()}
+
+
+def apply_method_rules(smali, compiled):
+    """Replace the body of every method of smali (a SmaliFile) that a MethodRule matches."""
+    # Last method first, so the positions of the others stay valid.
+    for method in reversed(smali.find_methods(compiled.methods)):
+        rule = compiled.rules[compiled.methods.search(method.header).lastgroup]
+        metrics().rule(rule.name, matches=1)
+        logging.debug(f"Found method {rule.name}. Clearing method content.")
+        with metrics().timed_rule(rule.name):
+            body = rule.body
+            if rule.keep_registers:
+                registers = [line for line in smali.body_lines(method) if line.strip().startswith('.registers')]
+                body = registers[-1:] + body
+            smali.replace_method_body(method, body)
+
+
+def find_anchors(smali, compiled):
+    """
+    Return [(line start offset, rule)] for every anchor hit in smali. One
+    scan of the buffer finds the lines that hold any anchor, and each of
+    those is searched for every anchor, so anchors that overlap or contain
+    one another on the same line are all found.
+    """
+    data = smali.data
+    hits = []
+    line_end = -1
+    for match in compiled.anchors.finditer(data):
+        if match.start() < line_end:
+            continue  # this line was already searched
+        position = smali.line_start(match.start())
+        line_end = data.find(b'\n', match.end())
+        line_end = len(data) if line_end < 0 else line_end
+        line = data[position:line_end]
+        hits.extend((position, rule) for anchor, rules in compiled.anchor_rules.items() if anchor in line
+                    for rule in rules)
+    return hits
+
+
+def insert_line(rule):
+    return lambda lines, index: lines[:index] + [rule.line] + lines[index:]
+
+
+def apply_anchor_rules(smali, compiled, found):
+    """
+    Run the InsertRules and AnchorRules at their anchor hits only, last hit
+    first so the offsets of the others stay valid. The hits inside one method
+    are handled on one copy of its lines that then replaces the method, so a
+    handler should not move lines above an earlier hit of the same method.
+    Adds the names of the rules that matched to found.
+    """
+    hits = find_anchors(smali, compiled)
+    method, method_hits = None, []
+    for position, rule in hits[::-1] + [(-1, None)]:
+        current = smali.method_at(position) if rule else None
+        if method and current != method:
+            lines = smali.method_lines(method)
+            for hit_position, hit_rule in method_hits:
+                index = smali.data.count(b'\n', method.start, hit_position)
+                func = insert_line(hit_rule) if isinstance(hit_rule, InsertRule) else hit_rule.func
+                with metrics().timed_rule(hit_rule.name):
+                    lines = func(lines, index)
+            smali.replace_method(method, lines)
+            method, method_hits = None, []
+        if not rule:
+            break
+        if isinstance(rule, AnchorRule) and not (current and (rule.method is None
+                                                              or re.search(rule.method, current.header))):
+            continue
+        found.add(rule.name)
+        metrics().rule(rule.name, matches=1)
+        logging.debug(f"Found anchor for {rule.name}")
+        if current:
+            method = current
+            method_hits.append((position, rule))
+        else:
+            with metrics().timed_rule(rule.name):
+                smali.insert_lines(position, [rule.line])
+
+
+def apply_rules(smali, compiled, found=None):
+    """Apply compiled to smali; the names of the anchor rules that matched are added to found."""
+    found = set() if found is None else found
+    if compiled.methods:
+        apply_method_rules(smali, compiled)
+    if compiled.anchors:
+        apply_anchor_rules(smali, compiled, found)
+
+
+def warn_missing(compiled, found):
+    for rule in compiled.rules.values():
+        if isinstance(rule, AnchorRule) and rule.name not in found:
+            logging.warning(f"Anchor not found for {rule.name}: {rule.anchor}")
+
+
+def iter_chunks(lines):
+    """
+    Group the lines (bytes) of a smali file into the pieces rules work on:
+    every method whole, `.method` through `.end method`, and every line
+    outside a method on its own.
+    """
+    method = []
+    for line in lines:
+        if method:
+            method.append(line)
+            if line.strip() == b'.end method':
+                yield b''.join(method)
+                method = []
+        elif line.lstrip().startswith(b'.method '):
+            method.append(line)
+        else:
+            yield line
+    if method:
+        yield b''.join(method)
+
+
+def needs_rules(chunk, compiled):
+    if compiled.anchors and compiled.anchors.search(chunk):
+        return True
+    if not (compiled.methods and chunk.lstrip().startswith(b'.method ')):
+        return False
+    return bool(compiled.methods.search(chunk.split(b'\n', 1)[0].decode()))
+
+
+def stream_rules(file_path, compiled, found):
+    """
+    Apply compiled to file_path one method at a time: lines are read through
+    iter_chunks, each method that a rule touches becomes a SmaliFile of its
+    own, and the result is written to a temp file next to file_path that
+    replaces it only if something changed. Peak memory is bounded by the
+    largest method rather than the file. Returns True if the file changed.
+    """
+    tmp_file = f"{file_path}.{os.getpid()}.tmp"
+    changed = False
+    try:
+        with open(file_path, 'rb') as source, open(tmp_file, 'wb') as out:
+            metrics().count('bytes_read', os.fstat(source.fileno()).st_size)
+            for chunk in iter_chunks(source):
+                if needs_rules(chunk, compiled):
+                    smali = SmaliFile(chunk)
+                    apply_rules(smali, compiled, found)
+                    changed = changed or smali.changed
+                    chunk = smali.data
+                # Like SmaliFile does for the whole file, so a rewritten file has one kind of newline.
+                out.write(normalize_newlines(chunk))
+        if changed:
+            replace_file(file_path, tmp_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return changed
+
+
+def apply_file_rules(file_path, compiled):
+    """Apply compiled to one file, streamed if it is large. Returns True if the file changed."""
+    found = set()
+    if os.path.getsize(file_path) > STREAM_THRESHOLD:
+        logging.debug(f"Streaming {file_path}")
+        changed = stream_rules(file_path, compiled, found)
+    else:
+        smali = SmaliFile.from_path(file_path)
+        apply_rules(smali, compiled, found)
+        changed = smali.changed
+        if changed:
+            write_bytes(file_path, smali.data)
+    warn_missing(compiled, found)
+    return changed
+
+
+def apply_compiled_rules(class_index, compiled_rules):
+    """Apply compiled_rules to the indexed classes and return the paths whose content changed."""
+    changed = []
+    for target, compiled in compiled_rules.items():
+        file_paths = class_index.get(target)
+        if not file_paths:
+            logging.warning(f"Class not found: {target}")
+            metrics().count('classes_missing')
+            continue
+        for file_path in file_paths:
+            logging.debug(f"Modifying file: {file_path}")
+            if not apply_file_rules(file_path, compiled):
+                logging.debug(f"No changes for file: {file_path}")
+                continue
+            metrics().count('files_modified')
+            changed.append(file_path)
+            logging.debug(f"Completed modification for file: {file_path}")
+    return changed
+
+
+INVOKE_CUSTOM_COMPILED = compile_target(INVOKE_CUSTOM_RULES)
+
+
+def patch(filepath):
+    """Stub the invoke-custom methods of filepath. Returns True if the file was rewritten."""
+    smali = SmaliFile.from_path(filepath)
+    if INVOKE_CUSTOM not in smali.data:
+        return False
+    apply_method_rules(smali, INVOKE_CUSTOM_COMPILED)
+    if not smali.changed:
+        return False
+    write_bytes(filepath, smali.data)
+    logging.debug(f"Completed modification for file: {filepath}")
+    return True
@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from patch_journal import snapshot
+from smali_metrics import collect, metrics, report_path
+
+BATCH_SIZE = 512
+INVOKE_CUSTOM = b'invoke-custom'
+# Written into every patched directory: the relative paths of the smali
+# files whose content changed, one per line. Empty means the directory still
+# matches its dex and does not need to be reassembled.
+PATCHED_LIST = '.patched'
+CACHE_DIR = os.environ.get('PATCHER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'a15-patcher'))
+
+
+def get_worker_count(args):
+    """
+    Read the worker count passed as the first command line argument.
+    The workflow passes an empty string when no core count is given, in
+    which case the pool is sized to the machine's cores.
+    """
+    if args and args[0].strip().isdigit() and int(args[0]) > 0:
+        return int(args[0])
+    return os.cpu_count() or 1
+
+
+def replace_file(file_path, tmp_file):
+    """Journal the original file (see patch_journal), then rename tmp_file over it."""
+    snapshot(file_path)
+    os.replace(tmp_file, file_path)
+    metrics().count('files_written')
+    metrics().count('bytes_written', os.path.getsize(file_path))
+
+
+def write_bytes(file_path, data):
+    tmp_file = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as file:
+        file.write(data)
+    replace_file(file_path, tmp_file)
+
+
+def iter_smali_files(directory):
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".smali"):
+                yield os.path.join(root, file)
+
+
+def find_class_dirs(prefix, root='.'):
+    """
+    Return the decompiled dex directories for prefix (e.g. classes, classes2,
+    ..., classesN) in dex order, however many there are.
+    """
+    pattern = re.compile(re.escape(prefix) + r'(\d*)$')
+    found = []
+    for name in os.listdir(root):
+        match = pattern.match(name)
+        if match and os.path.isdir(os.path.join(root, name)):
+            found.append((int(match.group(1) or 1), os.path.join(root, name) if root != '.' else name))
+    return [directory for _, directory in sorted(found)]
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def walk_class_tree(directories):
+    """Walk every directory once and return {directory: [relative smali paths]}."""
+    return {directory: [os.path.relpath(filepath, directory) for filepath in iter_smali_files(directory)]
+            for directory in directories if os.path.isdir(directory)}
+
+
+def load_class_tree(directories, jar_path=None, cache_dir=CACHE_DIR):
+    """
+    Like walk_class_tree, but cached on disk under the SHA-256 of the jar
+    the directories were decompiled from, so later runs on the same
+    firmware skip the walk.
+    """
+    if not jar_path or not os.path.isfile(jar_path):
+        return walk_class_tree(directories)
+
+    cache_file = os.path.join(cache_dir, f"class-index-{file_sha256(jar_path)}.json")
+    try:
+        with open(cache_file) as file:
+            tree = json.load(file)
+        if list(tree) == [d for d in directories if os.path.isdir(d)]:
+            logging.info(f"Loaded class index for {jar_path} from {cache_file}")
+            return tree
+    except (OSError, ValueError):
+        pass
+
+    tree = walk_class_tree(directories)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(tree, file)
+    os.replace(tmp_file, cache_file)
+    return tree
+
+
+def build_class_index(tree):
+    """Map every `Lpkg/Class;` descriptor to its smali path(s) in dex order."""
+    index = {}
+    for directory, files in tree.items():
+        for relative_path in files:
+            descriptor = 'L' + relative_path[:-len('.smali')].replace(os.sep, '/') + ';'
+            index.setdefault(descriptor, []).append(os.path.join(directory, relative_path))
+    return index
+
+
+def iter_batches(tree, batch_size=BATCH_SIZE):
+    for directory, files in tree.items():
+        for start in range(0, len(files), batch_size):
+            yield directory, [os.path.join(directory, file) for file in files[start:start + batch_size]]
+
+
+def patch_batch(patch_func, batch):
+    """Patch one batch; returns (scanned, modified paths, metrics of the batch)."""
+    with collect() as batch_metrics:
+        modified = [filepath for filepath in batch if patch_func(filepath)]
+        batch_metrics.count('files_scanned', len(batch))
+        batch_metrics.count('files_modified', len(modified))
+    return len(batch), modified, batch_metrics.to_dict()
+
+
+def scan_smali_files(tree, patch_func, workers=None, batch_size=BATCH_SIZE):
+    """
+    Run patch_func on every .smali file of a class tree (see load_class_tree).
+
+    With more than one worker the files are split into batches and spread
+    over a process pool; every file is patched independently, so the output
+    is the same as the serial path. Returns {directory: [modified paths]}.
+    """
+    workers = workers or os.cpu_count() or 1
+    totals = {directory: (0, []) for directory in tree}
+    for directory in tree:
+        logging.info(f"Scanning directory: {directory}")
+    batches = iter_batches(tree, batch_size)
+
+    if workers == 1:
+        results = ((directory, patch_batch(patch_func, batch)) for directory, batch in batches)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        batches = list(batches)
+        counts = executor.map(partial(patch_batch, patch_func), [batch for _, batch in batches])
+        results = zip([directory for directory, _ in batches], counts)
+
+    try:
+        for directory, (scanned, modified, batch_metrics) in results:
+            metrics().merge(batch_metrics)
+            total_scanned, total_modified = totals[directory]
+            totals[directory] = (total_scanned + scanned, total_modified + modified)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+
+    for directory, (scanned, modified) in totals.items():
+        logging.info(f"Scanned {scanned} files in {directory}, modified {len(modified)}")
+    return {directory: modified for directory, (_, modified) in totals.items()}
+
+
+def write_patched_lists(tree, modified):
+    """Write PATCHED_LIST into every directory of tree from the modified paths."""
+    for directory in tree:
+        prefix = os.path.join(directory, '')
+        patched = sorted({os.path.relpath(path, directory) for path in modified if path.startswith(prefix)})
+        with open(os.path.join(directory, PATCHED_LIST), 'w') as file:
+            file.writelines(f"{path}\n" for path in patched)
+        if patched:
+            logging.info(f"{len(patched)} files changed in {directory}")
+        else:
+            logging.info(f"No changes in {directory}, its dex can be reused as is")
+
+
+def read_patched_list(directory):
+    """Return the paths listed in directory's PATCHED_LIST, or None if it was never patched."""
+    try:
+        with open(os.path.join(directory, PATCHED_LIST)) as file:
+            return file.read().splitlines()
+    except FileNotFoundError:
+        return None
+
+
+def run_patch_script(directories, compiled_rules, workers=None, jar_path=None):
+    """
+    Patch decompiled directories the way every patch script does: stub the
+    invoke-custom users, apply compiled_rules to their target classes and
+    write the PATCHED_LIST files and the metrics report of this run.
+    """
+    # smali_rules imports this module, so it can only be imported here.
+    from smali_rules import apply_compiled_rules, patch
+
+    if not directories:
+        logging.info("No decompiled directories found, nothing to patch")
+        return
+    with collect() as run_metrics:
+        with run_metrics.phase('index'):
+            tree = load_class_tree(directories, jar_path)
+        with run_metrics.phase('invoke-custom scan'):
+            modified = scan_smali_files(tree, patch, workers)
+        with run_metrics.phase('target rules'):
+            changed = apply_compiled_rules(build_class_index(tree), compiled_rules)
+        write_patched_lists(tree, [path for paths in modified.values() for path in paths] + changed)
+        run_metrics.report(report_path(directories[0]))
@@ -0,0 +1,239 @@
+"""
+Builds small but well-formed dex files for the tests: string, type, proto,
+field and method ids, class_defs with class_data and code_items, an optional
+hiddenapi_class_data section and the map_list. Classes have methods only.
+
+Code units in insns may be ('string', text), ('field', 'Lcls;->name:type')
+or ('method', 'Lcls;->name(params)return') instead of an int; they are
+replaced by the index of that item once the ids are sorted.
+"""
+import re
+import zlib
+import struct
+import hashlib
+from collections import namedtuple
+
+HEADER_SIZE = 0x70
+NO_INDEX = 0xffffffff
+ACC_STATIC, ACC_PRIVATE, ACC_CONSTRUCTOR = 0x8, 0x2, 0x10000
+TYPE_DESCRIPTOR = re.compile(r'\[*(?:L[^;]+;|[VZBSCIJFD])')
+MEMBER = re.compile(r'(L[^;]+;)->([^(:]+)(?::(.+)|(\(.*\).+))$')
+
+# hiddenapi: the flags of the method, or None for no hiddenapi data; methods
+# with the same code label share one code_item.
+Method = namedtuple('Method', ['name', 'proto', 'access_flags', 'insns', 'registers', 'hiddenapi', 'code'],
+                    defaults=(1, None, None))
+
+
+def uleb128(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def split_proto(proto):
+    """'(ILjava/lang/String;)Z' -> (('I', 'Ljava/lang/String;'), 'Z')"""
+    params, ret = proto[1:].split(')')
+    return tuple(TYPE_DESCRIPTOR.findall(params)), ret
+
+
+def shorty(params, ret):
+    return ''.join('L' if descriptor[0] in 'L[' else descriptor for descriptor in (ret,) + params)
+
+
+def build_dex(classes, call_sites=False):
+    """
+    Return the bytes of a dex with classes, [(descriptor, [Method])]. With
+    call_sites, the map_list claims a call_site_id section, which is all
+    the patcher looks at before searching code for invoke-custom.
+    """
+    strings, types, protos, fields, methods = set(), set(), set(), set(), set()
+
+    def add_type(descriptor):
+        types.add(descriptor)
+        strings.add(descriptor)
+
+    def add_proto(proto):
+        params, ret = split_proto(proto)
+        for descriptor in params + (ret,):
+            add_type(descriptor)
+        strings.add(shorty(params, ret))
+        protos.add((params, ret))
+
+    def add_reference(kind, text):
+        if kind == 'string':
+            strings.add(text)
+            return
+        descriptor, name, field_type, proto = MEMBER.match(text).groups()
+        add_type(descriptor)
+        strings.add(name)
+        if kind == 'field':
+            add_type(field_type)
+            fields.add((descriptor, name, field_type))
+        else:
+            add_proto(proto)
+            methods.add((descriptor, name, split_proto(proto)))
+
+    add_type('Ljava/lang/Object;')
+    for descriptor, class_methods in classes:
+        add_type(descriptor)
+        for method in class_methods:
+            add_reference('method', f"{descriptor}->{method.name}{method.proto}")
+            for unit in method.insns:
+                if isinstance(unit, tuple):
+                    add_reference(*unit)
+
+    strings = sorted(strings)
+    string_idx = {text: idx for idx, text in enumerate(strings)}
+    types = sorted(types, key=string_idx.get)
+    type_idx = {descriptor: idx for idx, descriptor in enumerate(types)}
+    protos = sorted(protos, key=lambda proto: (type_idx[proto[1]], [type_idx[param] for param in proto[0]]))
+    proto_idx = {proto: idx for idx, proto in enumerate(protos)}
+    fields = sorted(fields, key=lambda field: (type_idx[field[0]], string_idx[field[1]], type_idx[field[2]]))
+    field_idx = {field: idx for idx, field in enumerate(fields)}
+    methods = sorted(methods, key=lambda method: (type_idx[method[0]], string_idx[method[1]], proto_idx[method[2]]))
+    method_idx = {method: idx for idx, method in enumerate(methods)}
+
+    def resolve(unit):
+        if not isinstance(unit, tuple):
+            return unit
+        kind, text = unit
+        if kind == 'string':
+            return string_idx[text]
+        descriptor, name, field_type, proto = MEMBER.match(text).groups()
+        if kind == 'field':
+            return field_idx[(descriptor, name, field_type)]
+        return method_idx[(descriptor, name, split_proto(proto))]
+
+    string_ids_off = HEADER_SIZE
+    type_ids_off = string_ids_off + 4 * len(strings)
+    proto_ids_off = type_ids_off + 4 * len(types)
+    field_ids_off = proto_ids_off + 12 * len(protos)
+    method_ids_off = field_ids_off + 8 * len(fields)
+    class_defs_off = method_ids_off + 8 * len(methods)
+    data_off = class_defs_off + 32 * len(classes)
+    data = bytearray()
+    sections = []
+
+    def offset():
+        return data_off + len(data)
+
+    def align():
+        data.extend(b'\0' * (-offset() % 4))
+
+    def section(item_type, size):
+        sections.append((item_type, size, offset()))
+
+    align()
+    code_items_off = offset()
+    code_offs = {}
+    code_labels = {}
+    for descriptor, class_methods in classes:
+        for method in class_methods:
+            if method.code is not None and method.code in code_labels:
+                code_offs[(descriptor, method.name, method.proto)] = code_labels[method.code]
+                continue
+            align()
+            code_off = offset()
+            code_offs[(descriptor, method.name, method.proto)] = code_off
+            if method.code is not None:
+                code_labels[method.code] = code_off
+            params, _ = split_proto(method.proto)
+            ins = sum(2 if param in 'JD' else 1 for param in params) + (not method.access_flags & ACC_STATIC)
+            insns = [resolve(unit) for unit in method.insns]
+            data.extend(struct.pack('<4HII', method.registers, ins, 0, 0, 0, len(insns)))
+            data.extend(struct.pack(f'<{len(insns)}H', *insns))
+    sections.append((0x2001, len(set(code_offs.values())), code_items_off))
+
+    align()
+    type_list_offs = {}
+    section(0x1001, sum(1 for params, _ in protos if params))
+    for params, ret in protos:
+        if params:
+            align()
+            type_list_offs[(params, ret)] = offset()
+            data.extend(struct.pack(f'<I{len(params)}H', len(params), *(type_idx[param] for param in params)))
+
+    string_data_offs = []
+    section(0x2002, len(strings))
+    for text in strings:
+        string_data_offs.append(offset())
+        data.extend(uleb128(len(text)) + text.encode() + b'\0')
+
+    class_data_offs = []
+    hiddenapi = []
+    section(0x2000, len(classes))
+    for descriptor, class_methods in classes:
+        class_data_offs.append(offset())
+        entries = sorted(((method_idx[(descriptor, method.name, split_proto(method.proto))], method)
+                          for method in class_methods), key=lambda entry: entry[0])
+        direct = [entry for entry in entries
+                  if entry[1].access_flags & (ACC_STATIC | ACC_PRIVATE | ACC_CONSTRUCTOR)]
+        virtual = [entry for entry in entries if entry not in direct]
+        data.extend(uleb128(0) + uleb128(0) + uleb128(len(direct)) + uleb128(len(virtual)))
+        for group in (direct, virtual):
+            previous = 0
+            for idx, method in group:
+                data.extend(uleb128(idx - previous) + uleb128(method.access_flags)
+                            + uleb128(code_offs[(descriptor, method.name, method.proto)]))
+                previous = idx
+        ordered = [method for _, method in direct + virtual]
+        hiddenapi.append([method.hiddenapi for method in ordered]
+                         if any(method.hiddenapi is not None for method in ordered) else None)
+
+    if any(flags is not None for flags in hiddenapi):
+        align()
+        section(0xf000, 1)
+        body = bytearray()
+        class_offs = []
+        for flags in hiddenapi:
+            if flags is None:
+                class_offs.append(0)
+                continue
+            class_offs.append(4 + 4 * len(classes) + len(body))
+            body.extend(b''.join(uleb128(flag or 0) for flag in flags))
+        data.extend(struct.pack(f'<I{len(classes)}I', 4 + 4 * len(classes) + len(body), *class_offs) + body)
+
+    align()
+    map_off = offset()
+    items = [(0x0000, 1, 0), (0x0001, len(strings), string_ids_off), (0x0002, len(types), type_ids_off),
+             (0x0003, len(protos), proto_ids_off), (0x0004, len(fields), field_ids_off),
+             (0x0005, len(methods), method_ids_off), (0x0006, len(classes), class_defs_off)]
+    if call_sites:
+        items.append((0x0007, 1, data_off))
+    items += [item for item in sections if item[1]] + [(0x1000, 1, map_off)]
+    items = [item for item in items if item[1]]
+    data.extend(struct.pack('<I', len(items)))
+    for item_type, size, item_off in items:
+        data.extend(struct.pack('<HHII', item_type, 0, size, item_off))
+
+    out = bytearray(data_off) + data
+    out[:8] = b'dex\n039\0'
+    struct.pack_into('<20I', out, 32, len(out), HEADER_SIZE, 0x12345678, 0, 0, map_off,
+                     len(strings), string_ids_off, len(types), type_ids_off, len(protos), proto_ids_off,
+                     len(fields), field_ids_off if fields else 0, len(methods), method_ids_off,
+                     len(classes), class_defs_off, len(data), data_off)
+    for idx, string_data_off in enumerate(string_data_offs):
+        struct.pack_into('<I', out, string_ids_off + 4 * idx, string_data_off)
+    for idx, descriptor in enumerate(types):
+        struct.pack_into('<I', out, type_ids_off + 4 * idx, string_idx[descriptor])
+    for idx, (params, ret) in enumerate(protos):
+        struct.pack_into('<3I', out, proto_ids_off + 12 * idx, string_idx[shorty(params, ret)], type_idx[ret],
+                         type_list_offs.get((params, ret), 0))
+    for idx, (descriptor, name, field_type) in enumerate(fields):
+        struct.pack_into('<HHI', out, field_ids_off + 8 * idx, type_idx[descriptor], type_idx[field_type],
+                         string_idx[name])
+    for idx, (descriptor, name, proto) in enumerate(methods):
+        struct.pack_into('<HHI', out, method_ids_off + 8 * idx, type_idx[descriptor], proto_idx[proto],
+                         string_idx[name])
+    for idx, (descriptor, _) in enumerate(classes):
+        struct.pack_into('<8I', out, class_defs_off + 32 * idx, type_idx[descriptor], 0x1,
+                         type_idx['Ljava/lang/Object;'], 0, NO_INDEX, 0, class_data_offs[idx], 0)
+    out[12:32] = hashlib.sha1(out[32:]).digest()
+    struct.pack_into('<I', out, 8, zlib.adler32(out[12:]))
+    return bytes(out)
@@ -0,0 +1,128 @@
+import io
+import os
+import sys
+import sqlite3
+import hashlib
+import importlib
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    # app opens its database, uploads and jobs relative to the working directory at import.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('A15_DATABASE', str(tmp_path / 'history.db'))
+    monkeypatch.setenv('A15_JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.syspath_prepend(BACKEND_DIR)
+    for name in ('app', 'patch_jobs', 'blob_store', 'upload_sessions'):
+        sys.modules.pop(name, None)
+    return importlib.import_module('app')
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+def history_rows(backend):
+    with sqlite3.connect(backend.DATABASE) as db:
+        return db.execute('SELECT name, sha256, original FROM history ORDER BY id').fetchall()
+
+
+def upload(client, content, name='test', **form):
+    return client.post('/api/upload', data={'file': (io.BytesIO(content), 'services.jar'), 'name': name, **form})
+
+
+def test_upload_stores_same_content_once(backend, client):
+    first = upload(client, b'jar one')
+    second = upload(client, b'jar one', name='again')
+    sha256 = hashlib.sha256(b'jar one').hexdigest()
+    assert first.status_code == second.status_code == 200
+    assert first.json['duplicate'] is False and second.json['duplicate'] is True
+    assert sorted(os.listdir('uploads')) == ['.sessions', f"{sha256}.jar"]
+    assert history_rows(backend) == [('test', sha256, 'services.jar'), ('again', sha256, 'services.jar')]
+
+
+def test_upload_by_hash_only_needs_a_stored_blob(backend, client):
+    sha256 = hashlib.sha256(b'jar one').hexdigest()
+    missing = client.post('/api/upload', data={'name': 'test', 'sha256': sha256, 'filename': 'services.jar'})
+    assert missing.status_code == 404 and missing.json['missing']
+    upload(client, b'jar one')
+    found = client.post('/api/upload', data={'name': 'test', 'sha256': sha256, 'filename': 'services.jar'})
+    assert found.status_code == 200 and found.json['duplicate'] is True
+
+
+def test_upload_rejects_wrong_hash(backend, client):
+    response = upload(client, b'jar one', sha256=hashlib.sha256(b'other').hexdigest())
+    assert response.status_code == 400
+    assert history_rows(backend) == []
+
+
+def test_upload_with_unknown_jar_adds_no_history(backend, client):
+    response = upload(client, b'jar one', patch='1', jar='unknown.jar')
+    assert response.status_code == 400
+    assert history_rows(backend) == []
+
+
+def test_history_pages_follow_the_cursor(backend, client):
+    for number in range(5):
+        upload(client, f"jar {number}".encode(), name=f"jar {number}")
+    names = []
+    response = client.get('/api/history?limit=2')
+    while True:
+        assert response.status_code == 200
+        names.extend(entry['name'] for entry in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        assert f"cursor={cursor}" in response.headers['Link']
+        response = client.get(f'/api/history?limit=2&cursor={cursor}')
+    assert names == [f"jar {number}" for number in range(4, -1, -1)]
+    assert client.get('/api/history?cursor=not-a-cursor').status_code == 400
+
+
+def test_history_etag_changes_on_upload(backend, client):
+    upload(client, b'jar one')
+    etag = client.get('/api/history').headers['ETag']
+    assert client.get('/api/history', headers={'If-None-Match': etag}).status_code == 304
+    upload(client, b'jar two')
+    response = client.get('/api/history', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_upload_session_resumes_and_finalizes(backend, client):
+    content = b'0123456789' * 10
+    sha256 = hashlib.sha256(content).hexdigest()
+    session = client.post('/api/uploads', json={'filename': 'services.jar', 'size': len(content), 'sha256': sha256})
+    assert session.status_code == 201
+    url = f"/api/uploads/{session.json['id']}"
+
+    assert client.put(f"{url}?offset=0", data=content[:40]).headers['Upload-Offset'] == '40'
+    gap = client.put(f"{url}?offset=60", data=content[60:])
+    assert gap.status_code == 409 and gap.headers['Upload-Offset'] == '40'
+    incomplete = client.post(f"{url}/finalize", data={'name': 'test'})
+    assert incomplete.status_code == 409 and incomplete.json['offset'] == 40
+    # A resent chunk overlapping what the server has is fine.
+    resent = client.put(url, data=content[30:], headers={'Content-Range': f"bytes 30-99/{len(content)}"})
+    assert resent.status_code == 200 and resent.headers['Upload-Offset'] == '100'
+
+    finished = client.post(f"{url}/finalize", data={'name': 'test'})
+    assert finished.status_code == 200 and finished.json['entry']['sha256'] == sha256
+    assert history_rows(backend) == [('test', sha256, 'services.jar')]
+    assert client.get(url).status_code == 404
+    with open(os.path.join('uploads', f"{sha256}.jar"), 'rb') as file:
+        assert file.read() == content
+    again = client.post('/api/uploads', json={'filename': 'services.jar', 'size': len(content), 'sha256': sha256})
+    assert again.json == {'duplicate': True, 'sha256': sha256}
+
+
+def test_upload_session_rejects_wrong_content(backend, client):
+    session = client.post('/api/uploads', json={'size': 3, 'sha256': hashlib.sha256(b'abc').hexdigest()})
+    url = f"/api/uploads/{session.json['id']}"
+    assert client.put(f"{url}?offset=0", data=b'abcd').status_code == 409
+    client.put(f"{url}?offset=0", data=b'abd')
+    assert client.post(f"{url}/finalize", data={'name': 'test'}).status_code == 409
+    assert history_rows(backend) == []
@@ -0,0 +1,34 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import load_manifest  # noqa: E402
+
+
+def write_manifest(tmp_path, entries):
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(entries))
+    return str(path)
+
+
+def test_load_manifest_resolves_jars_relative_to_it(tmp_path):
+    entries = load_manifest(write_manifest(tmp_path, {'entries': [
+        {'device': 'garnet', 'version': 'OS2.0.5.0', 'api': 35, 'jars': {'services': 'garnet/services.jar'}},
+    ]}))
+    assert entries[0]['api'] == '35'
+    assert entries[0]['jars'] == {'services': str(tmp_path / 'garnet' / 'services.jar')}
+
+
+@pytest.mark.parametrize('entries, message', [
+    ([{'device': 'garnet', 'version': 'OS2.0.5.0'}], 'has no jars'),
+    ([{'device': 'garnet', 'version': 'OS2.0.5.0', 'jars': {'settings': 'a.jar'}}], 'Unknown jar'),
+    ([{'device': 'garnet', 'version': 'OS2.0.5.0', 'jars': {'services': 'a.jar'}},
+      {'device': 'garnet', 'version': 'OS2.0.5.0', 'jars': {'framework': 'b.jar'}}], 'more than once'),
+])
+def test_load_manifest_rejects_bad_entries(tmp_path, entries, message):
+    with pytest.raises(ValueError, match=message):
+        load_manifest(write_manifest(tmp_path, entries))
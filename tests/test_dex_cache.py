@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dex_cache  # noqa: E402
+
+SETTINGS = dex_cache.build_settings(['smali.jar', 'baksmali.jar'])
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dex_cache, 'DEX_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+
+def write_dex(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_patched_dex_is_restored_on_the_next_run(tmp_path, cache_dir):
+    dex_path = write_dex(tmp_path / 'classes.dex', b'original')
+    pending = dex_cache.restore([dex_path], '35', SETTINGS)
+    assert list(pending) == [dex_path]
+    write_dex(tmp_path / 'classes.dex', b'patched')
+    dex_cache.store(pending)
+
+    write_dex(tmp_path / 'classes.dex', b'original')
+    assert dex_cache.restore([dex_path], '35', SETTINGS) == {}
+    assert (tmp_path / 'classes.dex').read_bytes() == b'patched'
+
+
+@pytest.mark.parametrize('api, settings', [
+    ('34', SETTINGS),
+    ('35', dex_cache.build_settings(['smali.jar', 'baksmali.jar'], dex_patch=False)),
+    ('35', dex_cache.build_settings(['smali-3.0.jar', 'baksmali.jar'])),
+])
+def test_other_api_or_settings_miss(tmp_path, cache_dir, api, settings):
+    dex_path = write_dex(tmp_path / 'classes.dex', b'original')
+    dex_cache.store(dex_cache.restore([dex_path], '35', SETTINGS))
+    assert list(dex_cache.restore([dex_path], api, settings)) == [dex_path]
+
+
+def test_tool_jars_are_keyed_by_content(tmp_path):
+    tool = tmp_path / 'smali.jar'
+    tool.write_bytes(b'smali 2.5.2')
+    before = dex_cache.build_settings([str(tool)])
+    tool.write_bytes(b'smali 3.0.3')
+    assert dex_cache.build_settings([str(tool)]) != before
+
+
+def test_evict_removes_least_recently_used_first(tmp_path, cache_dir):
+    paths = [write_dex(tmp_path / f"classes{number}.dex", bytes([number]) * 100) for number in range(3)]
+    dex_cache.store(dex_cache.restore(paths, '35', SETTINGS))
+    entries = {path: dex_cache.cache_path(dex_cache.file_sha256(path), '35', dex_cache.ruleset_version(),
+                                          SETTINGS) for path in paths}
+    for age, path in enumerate(paths):
+        os.utime(entries[path], (1000 + age, 1000 + age))
+    # A hit makes the oldest entry the most recently used.
+    assert dex_cache.restore(paths[:1], '35', SETTINGS) == {}
+
+    dex_cache.evict(max_bytes=200)
+    assert sorted(os.listdir(cache_dir)) == sorted(os.path.basename(entries[path]) for path in (paths[0], paths[2]))
@@ -0,0 +1,94 @@
+import os
+import sys
+import zlib
+import struct
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import smali_rules  # noqa: E402
+from dex_builder import Method, build_dex  # noqa: E402
+from dex_file import DexFile  # noqa: E402
+from dex_patch import patch_dex  # noqa: E402
+from pipeline import Build  # noqa: E402
+from smali_rules import MethodRule, compile_rules  # noqa: E402
+
+ACC_PUBLIC = 0x1
+CONST_4_V0_1, RETURN_V0, RETURN_VOID, NOP = 0x1012, 0x000f, 0x000e, 0x0000
+RETURN_FALSE_INSNS = [0x0012, RETURN_V0]
+LONG_BODY = [CONST_4_V0_1, NOP, NOP, RETURN_V0]
+
+
+def rule(target, pattern):
+    return MethodRule((target,), 'stub', pattern, ["    .registers 1\n"] + smali_rules.RETURN_FALSE, False)
+
+
+def method_insns(dex, descriptor, name):
+    for class_descriptor, class_data_off in dex.iter_class_defs():
+        if class_descriptor != descriptor:
+            continue
+        for method_idx, _, code_off in dex.iter_class_methods(class_data_off):
+            if dex.method(method_idx)[1] == name:
+                return list(dex.insns(code_off))
+    raise KeyError(name)
+
+
+def test_stub_is_padded_with_nops_and_checksums_recomputed():
+    dex = DexFile(build_dex([('LA;', [Method('check', '()Z', ACC_PUBLIC, LONG_BODY),
+                                      Method('keep', '()Z', ACC_PUBLIC, LONG_BODY)])]))
+    patched, unsupported = patch_dex(dex, compile_rules([rule('LA;', r'\.method public check\(\)Z')]))
+    assert patched == ['LA;->check()Z'] and unsupported == []
+
+    data = dex.to_bytes()
+    assert struct.unpack_from('<I', data, 8)[0] == zlib.adler32(data[12:])
+    assert data[12:32] == hashlib.sha1(data[32:]).digest()
+    patched_dex = DexFile(data)
+    assert method_insns(patched_dex, 'LA;', 'check') == RETURN_FALSE_INSNS + [NOP, NOP]
+    assert method_insns(patched_dex, 'LA;', 'keep') == LONG_BODY
+
+
+def test_hiddenapi_flags_are_part_of_the_declaration():
+    # baksmali prints `.method public blacklist hidden()Z` for restriction 2.
+    dex = DexFile(build_dex([('LA;', [Method('hidden', '()Z', ACC_PUBLIC, LONG_BODY, hiddenapi=2),
+                                      Method('visible', '()Z', ACC_PUBLIC, LONG_BODY, hiddenapi=0)])]))
+    patched, _ = patch_dex(dex, compile_rules([rule('LA;', r'\.method public blacklist \w+\(\)Z')]))
+    assert patched == ['LA;->hidden()Z']
+    assert method_insns(dex, 'LA;', 'visible') == LONG_BODY
+
+
+def test_body_that_does_not_fit_leaves_the_dex_to_baksmali(tmp_path):
+    data = build_dex([('LA;', [Method('check', '()Z', ACC_PUBLIC, [CONST_4_V0_1]),
+                               Method('other', '()Z', ACC_PUBLIC, LONG_BODY)])])
+    dex_path = tmp_path / 'classes.dex'
+    dex_path.write_bytes(data)
+    targets = compile_rules([rule('LA;', r'\.method public (check|other)\(\)Z')])
+
+    _, unsupported = patch_dex(DexFile(data), targets)
+    assert unsupported == [('LA;', 'stub')]
+    build = Build(argparse.Namespace(jobs=1, smali='smali.jar', baksmali='baksmali.jar', no_dex_patch=False,
+                                     api='35'))
+    assert build.patch_in_place(str(dex_path), DexFile(data), targets) is False
+    assert dex_path.read_bytes() == data
+
+
+def test_shared_code_item_is_not_stubbed():
+    # d8 gives identical bodies one code_item; stubbing it would stub both methods.
+    dex = DexFile(build_dex([('LA;', [Method('check', '()Z', ACC_PUBLIC, LONG_BODY, code='same'),
+                                      Method('keep', '()Z', ACC_PUBLIC, LONG_BODY, code='same')])]))
+    before = bytes(dex.data)
+    patched, unsupported = patch_dex(dex, compile_rules([rule('LA;', r'\.method public check\(\)Z')]))
+    assert patched == [] and unsupported == [('LA;', 'stub')]
+    assert bytes(dex.data) == before
+
+
+def test_invoke_custom_classes_get_their_object_methods_stubbed():
+    invoke_custom = [0x00fc, 0, 0]  # invoke-custom {}, call_site@0
+    dex = DexFile(build_dex([('LA;', [Method('run', '()V', ACC_PUBLIC, invoke_custom + [RETURN_VOID]),
+                                      Method('toString', '()Ljava/lang/String;', ACC_PUBLIC,
+                                             [0x001a, ('string', 'A'), 0x0011])]),  # const-string, return-object
+                             ('LB;', [Method('toString', '()Ljava/lang/String;', ACC_PUBLIC, LONG_BODY)])],
+                            call_sites=True))
+    patched, unsupported = patch_dex(dex, {})
+    assert patched == ['LA;->toString()Ljava/lang/String;'] and unsupported == []
@@ -0,0 +1,70 @@
+import os
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jar_repack import LOCAL_HEADER, repack  # noqa: E402
+
+ENTRIES = [
+    ('AndroidManifest.xml', b'<manifest/>' * 50, zipfile.ZIP_DEFLATED),
+    ('classes.dex', b'dex\n035\0' + bytes(range(256)) * 8, zipfile.ZIP_STORED),
+    ('a.txt', b'x', zipfile.ZIP_STORED),
+    ('lib/arm64-v8a/libfoo.so', b'\x7fELF' + bytes(5000), zipfile.ZIP_STORED),
+    ('classes2.dex', b'dex\n035\0' + bytes(3000), zipfile.ZIP_DEFLATED),
+]
+
+
+@pytest.fixture
+def jar(tmp_path):
+    path = tmp_path / 'in.jar'
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data, method in ENTRIES:
+            archive.writestr(zipfile.ZipInfo(name), data, compress_type=method)
+    return str(path)
+
+
+def data_offsets(path):
+    with open(path, 'rb') as file, zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            file.seek(info.header_offset)
+            fields = LOCAL_HEADER.unpack(file.read(LOCAL_HEADER.size))
+            yield info, info.header_offset + LOCAL_HEADER.size + fields[9] + fields[10]
+
+
+def test_repack_replaces_entries_and_keeps_the_rest(jar, tmp_path):
+    (tmp_path / 'classes.dex').write_bytes(b'dex\n035\0patched')
+    (tmp_path / 'classes2.dex').write_bytes(b'dex\n035\0patched too' * 100)
+    (tmp_path / 'same.xml').write_bytes(ENTRIES[0][1])
+    out = str(tmp_path / 'out.jar')
+    replaced = repack(jar, {'classes.dex': str(tmp_path / 'classes.dex'),
+                            'classes2.dex': str(tmp_path / 'classes2.dex'),
+                            'AndroidManifest.xml': str(tmp_path / 'same.xml')}, out)
+    assert replaced == ['classes.dex', 'classes2.dex']
+    with zipfile.ZipFile(out) as archive:
+        assert archive.testzip() is None
+        assert [info.filename for info in archive.infolist()] == [name for name, _, _ in ENTRIES]
+        assert archive.read('classes.dex') == b'dex\n035\0patched'
+        assert archive.read('classes2.dex') == b'dex\n035\0patched too' * 100
+        assert archive.getinfo('classes2.dex').compress_type == zipfile.ZIP_DEFLATED
+        for name, data, _ in ENTRIES[:1] + ENTRIES[2:4]:
+            assert archive.read(name) == data
+
+
+def test_stored_entries_are_aligned(jar, tmp_path):
+    assert any(offset % 4 for info, offset in data_offsets(jar) if info.compress_type == zipfile.ZIP_STORED)
+    out = str(tmp_path / 'out.jar')
+    assert repack(jar, {}, out) == []
+    for info, offset in data_offsets(out):
+        if info.filename.endswith('.so'):
+            assert offset % 4096 == 0
+        elif info.compress_type == zipfile.ZIP_STORED:
+            assert offset % 4 == 0
+
+
+def test_unknown_entry_is_rejected(jar, tmp_path):
+    with pytest.raises(ValueError, match='missing.dex'):
+        repack(jar, {'missing.dex': jar}, str(tmp_path / 'out.jar'))
+    assert not os.path.exists(tmp_path / 'out.jar')
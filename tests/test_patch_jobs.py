@@ -0,0 +1,79 @@
+import io
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from blob_store import BlobStore  # noqa: E402
+from patch_jobs import FAILED, HOSTNAME, QUEUED, PatchQueue, jar_spec  # noqa: E402
+
+DEAD_OWNER = f"{HOSTNAME}:999999"
+
+
+class RecordingExecutor:
+    """Stands in for the thread pool so that jobs stay queued."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, function, job_id, *args):
+        self.submitted.append(job_id)
+
+
+@pytest.fixture
+def store(tmp_path):
+    blob_store = BlobStore(str(tmp_path / 'uploads'))
+    sha256, _, _ = blob_store.put_stream(io.BytesIO(b'services jar'))
+    return blob_store, sha256
+
+
+def make_queue(tmp_path, blob_store):
+    queue = PatchQueue(str(tmp_path / 'history.db'), blob_store, jobs_dir=str(tmp_path / 'jobs'))
+    queue.executor = RecordingExecutor()
+    return queue
+
+
+def set_owner(tmp_path, job_id, owner):
+    with sqlite3.connect(tmp_path / 'history.db') as db:
+        db.execute('UPDATE jobs SET owner = ? WHERE id = ?', (owner, job_id))
+
+
+def test_submit_returns_the_active_job_for_the_same_key(tmp_path, store):
+    blob_store, sha256 = store
+    queue = make_queue(tmp_path, blob_store)
+    first = queue.submit(sha256, jar_spec('services.jar'), '35')
+    second = queue.submit(sha256, jar_spec('services'), '35')
+    other_api = queue.submit(sha256, jar_spec('services.jar'), '34')
+    assert first['status'] == QUEUED
+    assert second['id'] == first['id']
+    assert other_api['id'] != first['id']
+    assert queue.executor.submitted == [first['id'], other_api['id']]
+
+
+def test_active_key_is_shared_between_processes(tmp_path, store):
+    blob_store, sha256 = store
+    first = make_queue(tmp_path, blob_store).submit(sha256, jar_spec('services.jar'), '35')
+    # A live owner on another host keeps its job.
+    set_owner(tmp_path, first['id'], 'other-host:1')
+    other = make_queue(tmp_path, blob_store)
+    assert other.submit(sha256, jar_spec('services.jar'), '35')['id'] == first['id']
+    assert other.executor.submitted == []
+
+
+def test_job_of_an_exited_process_is_failed_and_resubmitted(tmp_path, store):
+    blob_store, sha256 = store
+    first = make_queue(tmp_path, blob_store).submit(sha256, jar_spec('services.jar'), '35')
+    set_owner(tmp_path, first['id'], DEAD_OWNER)
+    queue = make_queue(tmp_path, blob_store)
+    assert queue.get(first['id'])['status'] == FAILED
+    second = queue.submit(sha256, jar_spec('services.jar'), '35')
+    assert second['id'] != first['id'] and second['status'] == QUEUED
+
+    # The same happens when the owner exits while this process runs.
+    set_owner(tmp_path, second['id'], DEAD_OWNER)
+    third = queue.submit(sha256, jar_spec('services.jar'), '35')
+    assert queue.get(second['id'])['status'] == FAILED
+    assert third['id'] not in (first['id'], second['id'])
@@ -0,0 +1,54 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import patch_journal  # noqa: E402
+from smali_utils import write_bytes  # noqa: E402
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('classes/com/foo')
+    for name in ('A', 'B'):
+        with open(f"classes/com/foo/{name}.smali", 'w') as file:
+            file.write(f".class public Lcom/foo/{name};\n")
+    return tmp_path
+
+
+def test_snapshot_keeps_the_first_original(tree):
+    write_bytes('classes/com/foo/A.smali', b'first rewrite\n')
+    write_bytes('classes/com/foo/A.smali', b'second rewrite\n')
+    with open(patch_journal.journal_path('classes/com/foo/A.smali')) as file:
+        assert file.read() == '.class public Lcom/foo/A;\n'
+    assert not os.path.exists(patch_journal.journal_path('classes/com/foo/B.smali'))
+
+
+def test_diff_shows_the_changes(tree):
+    write_bytes('classes/com/foo/A.smali', b'.class public Lcom/foo/A;\n.super Ljava/lang/Object;\n')
+    out = io.StringIO()
+    patch_journal.diff(out=out)
+    assert out.getvalue().splitlines()[:2] == ['--- a/classes/com/foo/A.smali', '+++ b/classes/com/foo/A.smali']
+    assert '+.super Ljava/lang/Object;' in out.getvalue().splitlines()
+
+
+def test_restore_puts_back_the_originals(tree):
+    write_bytes('classes/com/foo/A.smali', b'patched\n')
+    write_bytes('classes/com/foo/B.smali', b'patched\n')
+    assert patch_journal.restore(['classes/com/foo/B.smali']) == 1
+    with open('classes/com/foo/B.smali') as file:
+        assert file.read() == '.class public Lcom/foo/B;\n'
+    assert patch_journal.restore() == 1
+    with open('classes/com/foo/A.smali') as file:
+        assert file.read() == '.class public Lcom/foo/A;\n'
+    assert patch_journal.restore() == 0
+
+
+def test_clear_forgets_a_directory(tree):
+    write_bytes('classes/com/foo/A.smali', b'patched\n')
+    patch_journal.clear(['classes'])
+    assert patch_journal.restore() == 0
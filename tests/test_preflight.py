@@ -0,0 +1,97 @@
+import os
+import sys
+import types
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import preflight  # noqa: E402
+from dex_builder import Method, build_dex  # noqa: E402
+from smali_rules import AnchorRule, InsertRule, MethodRule  # noqa: E402
+
+ACC_PUBLIC = 0x1
+RETURN_VOID = 0x000e
+TARGET = 'Lcom/android/server/A;'
+
+# checkSignatures: const-string v0, "verify: %s"; sget v0, B;->sMode:I; invoke-static {}, B;->isEnabled()Z.
+# The class has hiddenapi data, so checkSignatures reads as whitelist.
+CLASSES = [(TARGET, [
+    Method('checkSignatures', '(I)Z', ACC_PUBLIC,
+           [0x001a, ('string', 'verify: %s'), 0x0060, ('field', 'Lcom/android/server/B;->sMode:I'),
+            0x0071, ('method', 'Lcom/android/server/B;->isEnabled()Z'), 0, RETURN_VOID], registers=2),
+    Method('isHidden', '()Z', ACC_PUBLIC, [RETURN_VOID], hiddenapi=2),
+])]
+
+
+@pytest.mark.parametrize('anchor, expected', [
+    ('invoke-static {}, Lcom/android/server/B;->isEnabled()Z',
+     {('method', 'Lcom/android/server/B;->isEnabled()Z')}),
+    ('sget-object v0, Lcom/android/server/B;->sMode:I', {('field', 'Lcom/android/server/B;->sMode:I')}),
+    ('const-string v0, "a \\"b\\"\\n"', {('string', 'a "b"\n')}),
+    ('const/4 v1, 0x0', None),
+    ('verify:', {('text', 'verify:')}),
+])
+def test_anchor_references(anchor, expected):
+    assert preflight.anchor_references(anchor) == expected
+
+
+@pytest.fixture
+def methods(tmp_path):
+    jar_path = tmp_path / 'framework.jar'
+    with zipfile.ZipFile(jar_path, 'w') as jar:
+        jar.writestr('classes.dex', build_dex(CLASSES))
+    return preflight.index_classes(str(jar_path), {TARGET})[TARGET]
+
+
+@pytest.mark.parametrize('rule, statuses', [
+    (MethodRule((TARGET,), 'm', r'\.method public whitelist checkSignatures\(I\)Z', [], True), ('ok', '-')),
+    (MethodRule((TARGET,), 'm', r'\.method public blacklist isHidden', [], True), ('ok', '-')),
+    (MethodRule((TARGET,), 'm', r'\.method public removed\(', [], True), ('MISSING', '-')),
+    (InsertRule((TARGET,), 'i', 'Lcom/android/server/B;->isEnabled()Z', ''), ('-', 'ok')),
+    (InsertRule((TARGET,), 'i', 'Lcom/android/server/B;->gone()V', ''), ('-', 'MISSING')),
+    (AnchorRule((TARGET,), 'a', 'verify:', r'checkSignatures', None), ('ok', 'ok')),
+    (AnchorRule((TARGET,), 'a', 'verify:', r'isHidden', None), ('ok', 'MISSING')),
+    (AnchorRule((TARGET,), 'a', 'verify:', r'removed', None), ('MISSING', '?')),
+    (AnchorRule((TARGET,), 'a', 'if-eqz v0, :cond_0', None, None), ('-', '?')),
+])
+def test_check_rule(methods, rule, statuses):
+    assert preflight.check_rule(rule, methods) == statuses
+
+
+@pytest.fixture
+def run_preflight(tmp_path, monkeypatch):
+    with zipfile.ZipFile(tmp_path / 'framework.jar', 'w') as jar:
+        jar.writestr('classes.dex', build_dex(CLASSES))
+
+    def run(rules):
+        module = types.ModuleType('preflight_test_rules')
+        module.RULES = rules
+        monkeypatch.setitem(sys.modules, module.__name__, module)
+        monkeypatch.setitem(preflight.RULE_MODULES, 'framework', module.__name__)
+        return preflight.main(['--workdir', str(tmp_path), 'framework'])
+    return run
+
+
+MATCHING = [
+    MethodRule((TARGET,), 'checkSignatures', r'\.method.* checkSignatures\(', [], True),
+    InsertRule((TARGET,), 'isEnabled', 'Lcom/android/server/B;->isEnabled()Z', ''),
+]
+
+
+def test_exit_code_is_0_when_every_rule_matches(run_preflight):
+    assert run_preflight(MATCHING) == 0
+
+
+def test_exit_code_is_1_when_a_required_rule_matches_nothing(run_preflight):
+    assert run_preflight(MATCHING + [MethodRule((TARGET,), 'removed', r'\.method public removed\(', [], True)]) == 1
+    assert run_preflight(MATCHING + [MethodRule(('LMissing;',), 'gone', r'\.method', [], True)]) == 1
+
+
+def test_optional_rules_only_warn(run_preflight):
+    # A rule applies as long as one of its targets has everything it needs.
+    rules = MATCHING + [MethodRule((TARGET,), 'legacy', r'\.method public removed\(', [], True, True),
+                        MethodRule(('LMissing;', TARGET), 'moved', r'\.method.* checkSignatures', [], True)]
+    assert run_preflight(rules) == 0
@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smali_model import SmaliFile  # noqa: E402
+
+SOURCE = (b'.class public LA;\r\n'
+          b'.super Ljava/lang/Object;\r\n'
+          b'\r\n'
+          b'.method public a()V\r\n'
+          b'    return-void\r\n'
+          b'.end method\r\n'
+          b'\r\n'
+          b'.method public b(I)Z\r\n'
+          b'    .registers 2\r\n'
+          b'    const/4 v0, 0x0\r\n'
+          b'    return v0\r\n'
+          b'.end method\r\n'
+          b'\r\n'
+          b'.method public b(J)Z\r\n'
+          b'    const/4 v0, 0x0\r\n'
+          b'    return v0\r\n'
+          b'.end method\r\n')
+
+
+def assert_index_matches_a_fresh_scan(smali):
+    assert smali._methods is not None, "the index was dropped instead of shifted"
+    assert smali.methods == SmaliFile(smali.data).methods
+
+
+def test_lines_normalize_newlines():
+    smali = SmaliFile(SOURCE)
+    assert smali.lines()[:2] == ['.class public LA;\n', '.super Ljava/lang/Object;\n']
+    assert b'\r' not in smali.data
+
+
+def test_method_by_signature_or_name():
+    smali = SmaliFile(SOURCE)
+    assert smali.method('b(J)Z').header == '.method public b(J)Z'
+    assert smali.method('b').header == '.method public b(I)Z'
+    assert smali.method('c') is None
+
+
+def test_replace_method_shifts_the_index():
+    smali = SmaliFile(SOURCE)
+    method = smali.method('a')
+    smali.replace_method(method, ['.method public a()V\n', '    .registers 1\n', '    nop\n',
+                                  '    return-void\n', '.end method\n'])
+    assert_index_matches_a_fresh_scan(smali)
+    assert smali.body_lines(smali.method('a')) == ['    .registers 1\n', '    nop\n', '    return-void\n']
+
+    # A new `.method` line is indexed under its new signature.
+    smali.replace_method(smali.method('b(J)Z'), ['.method public c(J)Z\n', '    return v0\n', '.end method\n'])
+    assert_index_matches_a_fresh_scan(smali)
+    assert smali.method('b(J)Z') is None and smali.method('c').end == len(smali.data)
+
+
+def test_replace_method_body_and_insert_shift_the_index():
+    smali = SmaliFile(SOURCE)
+    smali.replace_method_body(smali.method('b(I)Z'), ['    .registers 2\n', '    const/4 v0, 0x1\n', '    return v0\n'])
+    smali.insert_lines(smali.method('a').start, ['# a\n'])
+    assert_index_matches_a_fresh_scan(smali)
+    assert smali.method_lines(smali.method('b'))[2] == '    const/4 v0, 0x1\n'
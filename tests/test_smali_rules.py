@@ -0,0 +1,109 @@
+import os
+import json
+import sys
+import shutil
+import importlib
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import smali_rules  # noqa: E402
+from smali_model import SmaliFile  # noqa: E402
+from smali_rules import InsertRule, MethodRule  # noqa: E402
+from smali_utils import find_class_dirs  # noqa: E402
+
+# input is a tiny decompiled tree with the targets of every patch script,
+# invoke-custom users and CRLF, no-trailing-newline, abstract and `.locals`
+# edge cases; expected is what the original line-based scripts made of it.
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'smali_tree')
+SCRIPTS = [
+    ('framework_patch', 'classes'),
+    ('services_patch', 'services_classes'),
+    ('miui-service_Patch', 'miui_services_classes'),
+]
+
+
+def smali_files(root):
+    found = {}
+    for directory, directories, files in os.walk(root):
+        directories[:] = [name for name in directories if not name.startswith('.')]  # .patch_journal
+        for name in files:
+            if name.endswith('.smali'):
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as file:
+                    found[os.path.relpath(path, root)] = file.read()
+    return found
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'input'), tmp_path / 'tree')
+    monkeypatch.chdir(tmp_path / 'tree')
+    monkeypatch.setenv('PATCHER_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'tree'
+
+
+def test_patch_stubs_invoke_custom_methods(tree):
+    for path in smali_files(tree / 'classes'):
+        smali_rules.patch(str(tree / 'classes' / path))
+    assert smali_files(tree / 'classes') == smali_files(os.path.join(FIXTURE_DIR, 'expected', 'classes'))
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['in-memory', 'streamed'])
+def test_patch_scripts_match_expected_tree(tree, monkeypatch, stream):
+    if stream:
+        monkeypatch.setattr(smali_rules, 'STREAM_THRESHOLD', 0)
+    for module, prefix in SCRIPTS:
+        importlib.import_module(module).modify_smali_files(find_class_dirs(prefix), 1)
+    assert smali_files(tree) == smali_files(os.path.join(FIXTURE_DIR, 'expected'))
+
+
+def test_each_script_reports_only_its_own_run(tree, monkeypatch, tmp_path):
+    monkeypatch.setenv('PATCHER_METRICS_DIR', str(tmp_path))
+    earlier_rules = set()
+    for module, prefix in SCRIPTS:
+        script = importlib.import_module(module)
+        directories = find_class_dirs(prefix)
+        script.modify_smali_files(directories, 1)
+        with open(tmp_path / f"{prefix}_metrics.json") as file:
+            report = json.load(file)
+        rule_names = {rule.name for rule in script.RULES}
+        assert set(report['rules']) & rule_names
+        # Every rule that matched is timed on its own.
+        assert all(entry['seconds'] > 0 for entry in report['rules'].values() if entry['matches'])
+        assert not set(report['rules']) & (earlier_rules - rule_names)
+        assert report['counters']['files_scanned'] == sum(len(smali_files(path)) for path in directories)
+        earlier_rules |= rule_names
+
+
+def test_overlapping_anchors_on_one_line_all_apply():
+    smali = SmaliFile(b'.class public LA;\n'
+                      b'.method public a()V\n'
+                      b'    const-string v0, "foobar"\n'
+                      b'    return-void\n'
+                      b'.end method\n')
+    rules = [InsertRule(('LA;',), name, anchor, f"    # {name}\n")
+             for name, anchor in [('whole', '"foobar"'), ('contained', 'oob'), ('overlapping', 'bar"')]]
+    found = set()
+    smali_rules.apply_rules(smali, smali_rules.compile_target(rules), found)
+    assert found == {'whole', 'contained', 'overlapping'}
+    lines = smali.data.decode().splitlines()
+    assert sorted(lines[2:5]) == ['    # contained', '    # overlapping', '    # whole']
+    assert lines[5] == '    const-string v0, "foobar"'
+
+
+@pytest.mark.parametrize('stream', [False, True], ids=['in-memory', 'streamed'])
+def test_crlf_target_is_rewritten_with_lf_only(tmp_path, monkeypatch, stream):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(smali_rules, 'STREAM_THRESHOLD', 0 if stream else 1 << 30)
+    path = tmp_path / 'A.smali'
+    path.write_bytes(b'.class public LA;\r\n.super Ljava/lang/Object;\r\n\r\n'
+                     b'.method public a()V\r\n    return-void\r\n.end method\r\n\r\n'
+                     b'.method public b()Z\r\n    const/4 v0, 0x1\r\n    return v0\r\n.end method\r\n')
+    rule = MethodRule(('LA;',), 'b', r'\.method public b\(\)Z', smali_rules.RETURN_FALSE, False)
+    assert smali_rules.apply_file_rules(str(path), smali_rules.compile_target([rule]))
+    assert path.read_bytes() == (b'.class public LA;\n.super Ljava/lang/Object;\n\n'
+                                 b'.method public a()V\n    return-void\n.end method\n\n'
+                                 b'.method public b()Z\n    const/4 v0, 0x0\n    return v0\n.end method\n')
@@ -3,30 +3,11 @@
 7z x framework.jar -oframework
 7z x services.jar -oservices
 
-if [ -f "framework/classes.dex" ]; then
-  java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "framework/classes.dex" -o classes
-else
-  echo "framework/classes.dex not found, skipping decompilation."
-fi
-
-for i in {2..5}; do
-  if [ -f "framework/classes${i}.dex" ]; then
-    java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "framework/classes${i}.dex" -o "classes${i}"
-  else
-    echo "framework/classes${i}.dex not found, skipping decompilation."
-  fi
+# Dex files without any class to patch are skipped and keep their original bytes.
+for dex in $(python3 dex_targets.py framework framework/classes*.dex); do
+  java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "$dex" -o "$(basename "$dex" .dex)"
 done
 
-if [ -f "services/classes.dex" ]; then
-  java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "services/classes.dex" -o services_classes
-else
-  echo "services/classes.dex not found, skipping decompilation."
-fi
-
-for i in {2..5}; do
-  if [ -f "services/classes${i}.dex" ]; then
-    java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "services/classes${i}.dex" -o "services_classes${i}"
-  else
-    echo "services/classes${i}.dex not found, skipping decompilation."
-  fi
+for dex in $(python3 dex_targets.py services services/classes*.dex); do
+  java -jar smali/baksmali/build/libs/baksmali.jar d -a 35 "$dex" -o "services_$(basename "$dex" .dex)"
 done
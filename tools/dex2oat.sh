@@ -1,29 +1,119 @@
 #!/bin/bash
 
+# Precompiles every .jar/.apk in the current directory into ./oat/arm64.
+# Several dex2oat jobs run at once, each on its own share of the CPU set;
+# inputs whose content and compiler flags match the stamp of an existing
+# art/odex/vdex set are skipped.
+#
+#   DEX2OAT_JOBS  number of concurrent jobs (default: 2)
+#   DEX2OAT_CPUS  CPUs to split between the jobs (default: 0,1,2,3,4,5,6,7)
+
+JOBS=${DEX2OAT_JOBS:-2}
+CPUS=${DEX2OAT_CPUS:-0,1,2,3,4,5,6,7}
+FLAGS="--compiler-filter=everything --instruction-set=arm64"
+OUT_DIR=./oat/arm64
+RESULT_DIR=$OUT_DIR/.results
+
 print() {
     echo -e "$@";
 }
 
+# Split the CPU list into JOBS sets, CPUs dealt out in turn.
+split_cpus() {
+    IFS=',' read -ra cpu_list <<< "$CPUS"
+    if [ "$JOBS" -gt "${#cpu_list[@]}" ]; then
+        JOBS=${#cpu_list[@]}
+    fi
+    CPU_SETS=()
+    for i in "${!cpu_list[@]}"; do
+        slot=$((i % JOBS))
+        CPU_SETS[$slot]="${CPU_SETS[$slot]:+${CPU_SETS[$slot]},}${cpu_list[$i]}"
+    done
+}
+
+# What the outputs of a file depend on: its content, the flags and the compiler.
+stamp_of() {
+    echo "$(sha256sum < "$1" | cut -d' ' -f1) $(sha256sum < ./dex2oat64 | cut -d' ' -f1) $FLAGS"
+}
+
+output_size() {
+    stat -c%s "$1.art" "$1.odex" "$1.vdex" 2>/dev/null | awk '{ total += $1 } END { print total + 0 }'
+}
+
 dex2oat() {
-    file_dir="./oat/arm64/${file_n%.*}"
-    mkdir -p ./oat/arm64
-    rm -rf $file_dir.art $file_dir.odex $file_dir.vdex
-    print "\nStarting compilation of file $file_n"
-    ./dex2oat64 --dex-file=./$file_n --compiler-filter=everything --instruction-set=arm64 --dex-location=./$file_n --app-image-file=$file_dir.art --cpu-set=0,1,2,3,4,5,6,7 --oat-file=$file_dir.odex
+    file_n=$1
+    cpu_set=$2
+    file_dir="$OUT_DIR/${file_n%.*}"
+    result="$RESULT_DIR/${file_n%.*}"
+    stamp=$(stamp_of "$file_n")
+
+    if [ -f "$file_dir.stamp" ] && [ "$(cat "$file_dir.stamp")" = "$stamp" ] \
+        && [ -f "$file_dir.art" ] && [ -f "$file_dir.odex" ] && [ -f "$file_dir.vdex" ]; then
+        print "Skipping $file_n, outputs are up to date"
+        echo "$file_n cached 0 $(output_size "$file_dir")" > "$result"
+        return 0
+    fi
+
+    rm -rf "$file_dir.art" "$file_dir.odex" "$file_dir.vdex" "$file_dir.stamp"
+    print "\nStarting compilation of file $file_n on CPUs $cpu_set"
+    start=$(date +%s%N)
+    if ! ./dex2oat64 --dex-file=./$file_n $FLAGS --dex-location=./$file_n --app-image-file=$file_dir.art \
+        --cpu-set=$cpu_set -j$(echo "$cpu_set" | tr ',' '\n' | wc -l) --oat-file=$file_dir.odex; then
+        print "Compilation of file $file_n failed"
+        echo "$file_n failed $(( ($(date +%s%N) - start) / 1000000 )) 0" > "$result"
+        return 1
+    fi
+    echo "$stamp" > "$file_dir.stamp"
+    echo "$file_n compiled $(( ($(date +%s%N) - start) / 1000000 )) $(output_size "$file_dir")" > "$result"
     print "Compilation of file $file_n completed"
 }
 
+report() {
+    printf "\n%-40s %-10s %8s %9s\n" File Status Time Size
+    failed=0
+    for result in "$RESULT_DIR"/*; do
+        read -r name status millis size < "$result"
+        printf "%-40s %-10s %7.1fs %9s\n" "$name" "$status" "$(echo "$millis" | awk '{ print $1 / 1000 }')" \
+            "$(numfmt --to=iec "$size")"
+        if [ "$status" = failed ]; then
+            failed=1
+        fi
+    done
+    rm -rf "$RESULT_DIR"
+    return $failed
+}
+
 compile_all_files() {
-    file=$(ls *.jar *.apk 2>/dev/null)
+    # Largest first, so a big file does not start last and hold up the run.
+    file=$(ls -S *.jar *.apk 2>/dev/null)
 
     if [ -z "$file" ]; then
         print "\nNo .jar or .apk files found in the directory.\n"
         exit 1
     fi
 
+    mkdir -p "$OUT_DIR"
+    rm -rf "$RESULT_DIR"
+    mkdir -p "$RESULT_DIR"
+    split_cpus
+    pids=()
+
     for file_n in $file; do
-        dex2oat
+        # Wait for a free slot; each slot owns one CPU set.
+        while true; do
+            for slot in "${!CPU_SETS[@]}"; do
+                if [ -z "${pids[$slot]}" ] || ! kill -0 "${pids[$slot]}" 2>/dev/null; then
+                    break 2
+                fi
+            done
+            wait -n
+        done
+        dex2oat "$file_n" "${CPU_SETS[$slot]}" &
+        pids[$slot]=$!
     done
+    wait
+
+    report
 }
 
 # Main execution
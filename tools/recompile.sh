@@ -1,41 +1,36 @@
 #!/bin/bash
 
-if [ -d classes ]; then
-  java -jar smali/smali/build/libs/smali.jar a -a 35 classes -o framework/classes.dex
-else
-  echo "classes directory not found, skipping recompilation."
-fi
-
-for i in {2..5}; do
-  if [ -d "classes$i" ]; then
-    java -jar smali/smali/build/libs/smali.jar a -a 35 "classes$i" -o "framework/classes$i.dex"
+for dex in framework/classes*.dex; do
+  dir=$(basename "$dex" .dex)
+  if [ -f "$dir/.patched" ] && [ ! -s "$dir/.patched" ]; then
+    echo "Nothing changed in $dir, keeping the original $dex."
+  elif [ -d "$dir" ]; then
+    java -jar smali/smali/build/libs/smali.jar a -a 35 "$dir" -o "$dex"
   else
-    echo "classes$i directory not found, skipping recompilation."
+    echo "$dir directory not found, skipping recompilation."
   fi
 done
 
-if [ -d services_classes ]; then
-  java -jar smali/smali/build/libs/smali.jar a -a 35 services_classes -o services/classes.dex
-else
-  echo "services_classes directory not found, skipping recompilation."
-fi
-
-for i in {2..5}; do
-  if [ -d "services_classes$i" ]; then
-    java -jar smali/smali/build/libs/smali.jar a -a 35 "services_classes$i" -o "services/classes$i.dex"
+for dex in services/classes*.dex; do
+  dir="services_$(basename "$dex" .dex)"
+  if [ -f "$dir/.patched" ] && [ ! -s "$dir/.patched" ]; then
+    echo "Nothing changed in $dir, keeping the original $dex."
+  elif [ -d "$dir" ]; then
+    java -jar smali/smali/build/libs/smali.jar a -a 35 "$dir" -o "$dex"
   else
-    echo "services_classes$i directory not found, skipping recompilation."
+    echo "$dir directory not found, skipping recompilation."
   fi
 done
 
-cd framework ||
-7z a -tzip ../framework_new.zip *
-cd ../services ||
-7z a -tzip ../services_new.zip *
-cd ..
-
-zipalign -f -p -v -z 4 framework_new.zip aligned_framework.jar
-zipalign -f -p -v -z 4 services_new.zip aligned_services.jar
+# Copies the original jar entries as they are, swaps in the dex files and
+# aligns stored entries in the same pass, so no zipalign run is needed.
+for jar in framework services; do
+  entries=()
+  for dex in "$jar"/classes*.dex; do
+    entries+=("$(basename "$dex")=$dex")
+  done
+  python3 jar_repack.py "$jar.jar" "aligned_$jar.jar" "${entries[@]}"
+done
 
 
 mkdir -p magisk_module/system/framework
@@ -46,6 +41,6 @@ cd magisk_module ||
 zip -r ../moded_framework_services.zip *
 
 cd ..
-rm -rf framework/classes*.dex services/classes*.dex framework_new.zip services_new.zip aligned_framework.jar aligned_services.jar
+rm -rf framework/classes*.dex services/classes*.dex aligned_framework.jar aligned_services.jar
 
 echo "Cleanup complete."